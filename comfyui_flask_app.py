@@ -1,18 +1,34 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 import websocket
 import uuid
 import json
-import urllib.request
-import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
 import io
 import base64
-from PIL import Image
+from PIL import Image, ImageOps
 import os
 import tempfile
 import random
 import logging
-from functools import wraps
+from functools import wraps, partial
+from contextlib import contextmanager
 import traceback
+import threading
+import time
+import queue
+import hashlib
+import asyncio
+import math
+import struct
+import re
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, Future
+
+try:
+    import pillow_avif  # noqa: F401  Registers an AVIF encoder with Pillow when installed
+except ImportError:
+    pass
 
 app = Flask(__name__)
 
@@ -22,44 +38,252 @@ logger = logging.getLogger(__name__)
 
 # ComfyUI server configuration
 SERVER_ADDRESS = "127.0.0.1:8188"
+
+# Additional ComfyUI instances: comma-separated host:port list, requests go to the shortest queue
+COMFYUI_BACKENDS = [address.strip() for address in os.environ.get('COMFYUI_BACKENDS', SERVER_ADDRESS).split(',') if address.strip()]
+BACKEND_CHECK_INTERVAL = float(os.environ.get('BACKEND_CHECK_INTERVAL', 5))  # Seconds between /queue polls
+BACKEND_MAX_FAILURES = int(os.environ.get('BACKEND_MAX_FAILURES', 3))  # Consecutive failures before ejection
 CLIENT_ID = str(uuid.uuid4())
 
-# Error handling decorator
+# POST /interrupt {"all": true} stops whatever every backend is executing, whoever queued it; off unless enabled
+ALLOW_GLOBAL_INTERRUPT = os.environ.get('ALLOW_GLOBAL_INTERRUPT', 'false').lower() in ('1', 'true', 'yes')
+
+# Websocket listener configuration
+WS_CONNECT_TIMEOUT = float(os.environ.get('WS_CONNECT_TIMEOUT', 10))
+WS_RECONNECT_DELAY = float(os.environ.get('WS_RECONNECT_DELAY', 2))
+WS_RECONNECT_GRACE = float(os.environ.get('WS_RECONNECT_GRACE', 60))  # Fail pending prompts after this long offline
+EXECUTION_TIMEOUT = float(os.environ.get('EXECUTION_TIMEOUT', 1800))
+
+# Output retrieval: 'history' downloads files via /history and /view,
+# 'websocket' swaps image outputs for SaveImageWebsocket nodes and reads the bytes from the socket
+OUTPUT_RETRIEVAL = os.environ.get('OUTPUT_RETRIEVAL', 'history')
+OUTPUT_RETRIEVAL_MODES = ('history', 'websocket')
+
+# Admission control: prompts allowed into ComfyUI at once, requests allowed to wait, and per-client limits
+SCHEDULER_MAX_ACTIVE = int(os.environ.get('SCHEDULER_MAX_ACTIVE', 2 * len(COMFYUI_BACKENDS)))
+SCHEDULER_MAX_QUEUE = int(os.environ.get('SCHEDULER_MAX_QUEUE', 64))
+SCHEDULER_PER_CLIENT = int(os.environ.get('SCHEDULER_PER_CLIENT', 2))  # Concurrent requests per client
+# Seconds a request may be passed over for requests that reuse the loaded models; 0 disables model affinity
+SCHEDULER_AFFINITY_WINDOW = float(os.environ.get('SCHEDULER_AFFINITY_WINDOW', 10))
+# Fair-share weights as "client=weight,..."; unlisted clients get weight 1
+CLIENT_WEIGHTS = {
+    client.strip(): float(weight)
+    for client, _, weight in (item.partition('=') for item in os.environ.get('CLIENT_WEIGHTS', '').split(',') if '=' in item)
+}
+
+# Result cache for seeded (deterministic) generations; set RESULT_CACHE_MAX_BYTES=0 to disable
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'illustrify-result-cache'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024**3))
+
+# Identical workflows submitted while one is already running attach to it instead of queueing again
+SINGLEFLIGHT = os.environ.get('SINGLEFLIGHT', 'true').lower() not in ('0', 'false', 'no')
+
+# HTTP connection pool configuration
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+UPLOAD_REGISTRY_SIZE = int(os.environ.get('UPLOAD_REGISTRY_SIZE', 4096))  # Uploaded input images remembered per backend
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 8))  # Parallel /view downloads per backend
+
+# Batch endpoint configuration
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 32))
+BATCH_SHARED_PARAMS = ('negative_prompt', 'width', 'height', 'steps', 'cfg', 'seed', 'num_images')
+MAX_IMAGES_PER_PROMPT = int(os.environ.get('MAX_IMAGES_PER_PROMPT', 8))  # Latent batch_size limit for num_images
+
+# Async job configuration
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))  # Seconds a finished job stays pollable
+# 'thread' runs each async job on a JOB_WORKERS thread; 'async' runs them as coroutines on one event loop
+JOB_EXECUTION_MODE = os.environ.get('JOB_EXECUTION_MODE', 'thread')
+JOB_EXECUTION_MODES = ('thread', 'async')
+if JOB_EXECUTION_MODE not in JOB_EXECUTION_MODES:
+    raise ValueError(f"JOB_EXECUTION_MODE must be one of: {', '.join(JOB_EXECUTION_MODES)}")
+ASYNC_IO_WORKERS = int(os.environ.get('ASYNC_IO_WORKERS', 16))  # Threads for blocking calls made by async jobs
+JOB_EVENT_HISTORY = int(os.environ.get('JOB_EVENT_HISTORY', 1000))  # Progress events kept for SSE replay
+SSE_KEEPALIVE_INTERVAL = int(os.environ.get('SSE_KEEPALIVE_INTERVAL', 15))
+
+# Live sampler previews (opt-in per job); ComfyUI must be started with --preview-method
+PREVIEW_MAX_FPS = float(os.environ.get('PREVIEW_MAX_FPS', 2))
+PREVIEW_MAX_SIZE = int(os.environ.get('PREVIEW_MAX_SIZE', 256))  # Longest side in pixels
+PREVIEW_JPEG_QUALITY = int(os.environ.get('PREVIEW_JPEG_QUALITY', 70))
+
+# Input images are decoded once, EXIF-rotated and shrunk to the workflow's target size before upload
+INPUT_PREPROCESSING = os.environ.get('INPUT_PREPROCESSING', 'true').lower() not in ('0', 'false', 'no')
+INPUT_JPEG_QUALITY = int(os.environ.get('INPUT_JPEG_QUALITY', 95))  # Re-encoded inputs without alpha are JPEG
+
+# Output transcoding: image outputs are PNG unless the request asks for output_format
+OUTPUT_FORMATS = ('png', 'webp', 'jpeg', 'avif')
+OUTPUT_QUALITY = int(os.environ.get('OUTPUT_QUALITY', 85))  # Default quality for lossy output formats
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', 4))  # Threads for transcoding, metadata stripping and thumbnails
+# ComfyUI embeds the prompt and workflow JSON in every PNG; drop it from responses unless disabled
+STRIP_OUTPUT_METADATA = os.environ.get('STRIP_OUTPUT_METADATA', 'true').lower() not in ('0', 'false', 'no')
+# Thumbnail sizes returned for "thumbnails": true, in PocketBase's WxH syntax
+THUMBNAIL_SIZES = [size.strip() for size in os.environ.get('THUMBNAIL_SIZES', '100x100').split(',') if size.strip()]
+THUMBNAIL_MAX_SIZE = int(os.environ.get('THUMBNAIL_MAX_SIZE', 1024))
+MAX_THUMBNAIL_SIZES = 4
+
+# Workflow templates: directory, file of each registered workflow, and how often files are checked for changes
+WORKFLOW_DIR = os.environ.get('WORKFLOW_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image-gen-worflows'))
+# Override file names as "workflow-name=File.json,..."
+WORKFLOW_FILES = {
+    'flux-krea-image-gen': 'Flux-KREA-Image-Gen.json',
+    'qwen-image-edit': 'Image-Edit-Workflow.json',
+    'wan-image-to-video': 'Image-To-Video.json',
+    **{
+        name.strip(): filename.strip()
+        for name, _, filename in (item.partition('=') for item in os.environ.get('WORKFLOW_FILES', '').split(',') if '=' in item)
+    }
+}
+WORKFLOW_RELOAD_INTERVAL = float(os.environ.get('WORKFLOW_RELOAD_INTERVAL', 2))  # Seconds between mtime checks
+
+# Latency histogram buckets in seconds, from body decoding (milliseconds) up to video generation (minutes)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Metrics
+class Metrics:
+    """In-memory counters, gauges and histograms rendered in the Prometheus text format"""
+
+    # name -> (type, help)
+    DEFINITIONS = {
+        'illustrify_stage_duration_seconds': (
+            'histogram', 'Time spent in each stage of a generation request (decode, preprocess, upload, queue_wait, execution, download, postprocess, encode)'),
+        'illustrify_errors_total': ('counter', 'Failed requests and jobs by error type'),
+        'illustrify_coalesced_requests_total': ('counter', 'Generations that attached to an identical in-flight generation or idempotent request'),
+        'illustrify_generations_in_flight': ('gauge', 'Generation requests currently being served, including those waiting for a slot'),
+        'illustrify_scheduler_active': ('gauge', 'Prompts admitted into ComfyUI by the scheduler'),
+        'illustrify_scheduler_queued': ('gauge', 'Requests waiting for a scheduler slot'),
+        'illustrify_model_switches_total': ('counter', 'Admitted requests whose models differed from every backend\'s last loaded set'),
+        'illustrify_model_switches_avoided_total': ('counter', 'Times the scheduler admitted a request reusing loaded models ahead of one that needed a switch'),
+        'illustrify_backend_in_flight': ('gauge', 'Prompts this API has in flight on each ComfyUI backend'),
+        'illustrify_backend_queue_depth': ('gauge', 'Queue length last reported by each ComfyUI backend'),
+        'illustrify_backend_healthy': ('gauge', 'Whether each ComfyUI backend is in rotation'),
+    }
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._values = defaultdict(dict)  # name -> {labels: value or histogram state}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter or gauge"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            if key not in series:
+                series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            histogram = series[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def time(self, stage, workflow):
+        """Observe how long the block takes as one stage of a request"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('illustrify_stage_duration_seconds', time.perf_counter() - start, stage=stage, workflow=workflow)
+
+    def collector(self, fn):
+        """Register fn() -> [(name, labels, value)] to read gauges at scrape time"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        collected = defaultdict(dict)
+        for fn in self._collectors:
+            for name, labels, value in fn():
+                collected[name][tuple(sorted(labels.items()))] = value
+        
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text) in self.DEFINITIONS.items():
+                series = {**self._values.get(name, {}), **collected.get(name, {})}
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for key, value in sorted(series.items()):
+                    if metric_type != 'histogram':
+                        lines.append(f"{name}{self._labels(key)} {value}")
+                        continue
+                    for bound, count in zip(self.buckets, value['buckets']):
+                        lines.append(f"{name}_bucket{self._labels(key + (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', '+Inf'),))} {value['count']}")
+                    lines.append(f"{name}_sum{self._labels(key)} {value['sum']}")
+                    lines.append(f"{name}_count{self._labels(key)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(key):
+        if not key:
+            return ''
+        escaped = (f'{label}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                   for label, value in key)
+        return '{' + ','.join(escaped) + '}'
+
+metrics = Metrics()
+
+# Error handling
+def describe_error(e):
+    """Map an exception to (message, error_type, status_code) for API responses"""
+    if isinstance(e, ConnectionError):
+        return 'Unable to connect to ComfyUI server. Please ensure it is running.', 'connection_error', 503
+    if isinstance(e, json.JSONDecodeError):
+        return 'Invalid JSON data provided.', 'json_error', 400
+    if isinstance(e, ValueError):
+        return str(e), 'value_error', 400
+    if isinstance(e, QueueFullError):
+        return str(e), 'queue_full', 429
+    if isinstance(e, WorkflowUnavailableError):
+        return str(e), 'workflow_error', 503
+    if isinstance(e, GenerationCancelled):
+        return str(e), 'cancelled', 409
+    if isinstance(e, ComfyUIExecutionError):
+        return str(e), 'execution_error', 502
+    if isinstance(e, TimeoutError):
+        return str(e), 'timeout_error', 504
+    return 'An unexpected error occurred. Please try again.', 'internal_error', 500
+
+# Failures that may succeed on a retry; a job that failed with one is not replayed for its Idempotency-Key
+RETRYABLE_ERROR_TYPES = ('connection_error', 'timeout_error', 'queue_full', 'workflow_error')
+
 def handle_errors(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         try:
             return f(*args, **kwargs)
-        except ConnectionError as e:
-            logger.error(f"Connection error: {str(e)}")
-            return jsonify({
-                'success': False,
-                'error': 'Unable to connect to ComfyUI server. Please ensure it is running.',
-                'error_type': 'connection_error'
-            }), 503
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {str(e)}")
-            return jsonify({
-                'success': False,
-                'error': 'Invalid JSON data provided.',
-                'error_type': 'json_error'
-            }), 400
-        except ValueError as e:
-            logger.error(f"Value error: {str(e)}")
-            return jsonify({
-                'success': False,
-                'error': str(e),
-                'error_type': 'value_error'
-            }), 400
         except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
-            logger.error(traceback.format_exc())
-            return jsonify({
+            message, error_type, status_code = describe_error(e)
+            metrics.inc('illustrify_errors_total', error_type=error_type)
+            if error_type == 'internal_error':
+                logger.error(f"Unexpected error: {str(e)}")
+                logger.error(traceback.format_exc())
+            else:
+                logger.error(f"{type(e).__name__}: {str(e)}")
+            body = {
                 'success': False,
-                'error': 'An unexpected error occurred. Please try again.',
-                'error_type': 'internal_error',
-                'details': str(e) if app.debug else None
-            }), 500
+                'error': message,
+                'error_type': error_type
+            }
+            if error_type == 'internal_error':
+                body['details'] = str(e) if app.debug else None
+            if isinstance(e, QueueFullError):
+                body['retry_after'] = e.retry_after
+            response = jsonify(body)
+            if isinstance(e, QueueFullError):
+                response.headers['Retry-After'] = str(e.retry_after)
+            return response, status_code
     return decorated_function
 
 # Validation functions
@@ -78,558 +302,3365 @@ def validate_prompt(prompt):
         raise ValueError("Prompt must be less than 1000 characters")
     return prompt.strip()
 
+# Output node handling
+IMAGE_OUTPUT_NODES = ('SaveImage', 'PreviewImage')
+OUTPUT_NODES = IMAGE_OUTPUT_NODES + ('SaveImageWebsocket', 'VHS_VideoCombine', 'SaveAnimatedWEBP', 'SaveAnimatedPNG', 'SaveVideo')
+
+def use_websocket_outputs(workflow):
+    """Swap image output nodes for SaveImageWebsocket, returning the new workflow and the swapped node ids"""
+    workflow = dict(workflow)
+    swapped = set()
+    for node_id, node in workflow.items():
+        if node['class_type'] in IMAGE_OUTPUT_NODES:
+            workflow[node_id] = {
+                'class_type': 'SaveImageWebsocket',
+                'inputs': {'images': node['inputs']['images']}
+            }
+            swapped.add(node_id)
+    return workflow, swapped
+
+def detect_image_type(image_data):
+    """Return (mimetype, extension) for image bytes, raising ValueError if they are not an image"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            image_format = image.format
+    except Exception:
+        raise ValueError('Input is not a supported image file')
+    extension = {'JPEG': 'jpg'}.get(image_format, image_format.lower())
+    return Image.MIME.get(image_format, 'application/octet-stream'), extension
+
+def preprocess_input_image(image_data, cover=None, total_pixels=None):
+    """Apply EXIF orientation and shrink an input image to the size the workflow will resize it to
+
+    cover=(width, height) keeps the image just large enough to cover that size, like WanImageToVideo's
+    center crop; total_pixels scales to that pixel count, like ImageScaleToTotalPixels. Images are never
+    upscaled. Returns the original bytes when nothing needs to change, otherwise JPEG (PNG with alpha).
+    """
+    if not INPUT_PREPROCESSING:
+        return image_data
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        
+        # Orientations 5-8 swap the axes, so targets are computed on the upright size
+        orientation = image.getexif().get(0x0112, 1)
+        width, height = image.size
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        
+        target = None
+        if cover is not None:
+            scale = max(cover[0] / width, cover[1] / height)
+            if scale < 1:
+                target = (math.ceil(width * scale), math.ceil(height * scale))
+        elif total_pixels is not None:
+            scale = math.sqrt(total_pixels / (width * height))
+            if scale < 1:
+                target = (round(width * scale), round(height * scale))
+        if target is None and orientation == 1:
+            return image_data
+        
+        if target is not None:
+            # JPEG can decode directly at 1/2, 1/4 or 1/8 scale, far faster than a full decode
+            image.draft(None, target if orientation not in (5, 6, 7, 8) else target[::-1])
+        original_size = image.size
+        image = ImageOps.exif_transpose(image)
+        if target is not None and image.size != target:
+            image = image.resize(target, Image.LANCZOS)
+        
+        buffer = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+            image.convert('RGBA').save(buffer, 'PNG')
+        else:
+            image.convert('RGB').save(buffer, 'JPEG', quality=INPUT_JPEG_QUALITY)
+    except Image.UnidentifiedImageError:
+        raise ValueError('Input is not a supported image file')
+    except Exception as e:
+        raise ValueError(f'Invalid image data: {str(e)}')
+    
+    logger.info(f"Preprocessed input image {original_size[0]}x{original_size[1]} ({len(image_data)} bytes) "
+                f"to {image.size[0]}x{image.size[1]} ({buffer.tell()} bytes)")
+    return buffer.getvalue()
+
+class ComfyUIExecutionError(RuntimeError):
+    """Raised when ComfyUI reports that a queued prompt failed or was interrupted"""
+
+    def __init__(self, message, status_code=None, details=None):
+        super().__init__(message)
+        self.status_code = status_code  # HTTP status when a REST call was rejected
+        self.details = details  # Its JSON body, e.g. /prompt's error and node_errors
+
+class PromptWaiter:
+    """Receives the websocket events of one queued prompt from the shared listener"""
+
+    def __init__(self, prompt_id):
+        self.prompt_id = prompt_id
+        self.workflow = None
+        self.websocket_nodes = set()
+        self._events = queue.Queue()
+
+    def put(self, message):
+        """Deliver a websocket message (dict) or binary frame (bytes)"""
+        self._events.put(message)
+
+    def fail(self, error):
+        """Abort the wait with the given exception"""
+        self._events.put(error)
+
+    def events(self, timeout):
+        """Yield events until the prompt finishes, raising on errors and timeouts"""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                event = self._events.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                raise TimeoutError(f"Prompt {self.prompt_id} did not finish within {timeout} seconds")
+            if isinstance(event, Exception):
+                raise event
+            yield event
+            if self.is_final(event):
+                return
+
+    def is_final(self, event):
+        """Return True once the prompt is done, raising if ComfyUI reported a failure"""
+        if isinstance(event, bytes):
+            return False
+        data = event.get('data') or {}
+        if event['type'] == 'executing' and data.get('node') is None:
+            return True  # Execution is done
+        if event['type'] == 'execution_error':
+            raise ComfyUIExecutionError(
+                f"ComfyUI failed in node {data.get('node_id')} ({data.get('node_type')}): {data.get('exception_message', '').strip()}"
+            )
+        if event['type'] == 'execution_interrupted':
+            raise ComfyUIExecutionError(f"Prompt {self.prompt_id} was interrupted")
+        return False
+
+class AsyncPromptWaiter(PromptWaiter):
+    """A PromptWaiter whose events are awaited on an asyncio event loop instead of blocking a thread"""
+
+    def __init__(self, prompt_id, loop):
+        super().__init__(prompt_id)
+        self._loop = loop
+        self._events = asyncio.Queue()
+
+    def put(self, message):
+        # Called from the listener thread
+        self._loop.call_soon_threadsafe(self._events.put_nowait, message)
+
+    def fail(self, error):
+        self._loop.call_soon_threadsafe(self._events.put_nowait, error)
+
+    async def events(self, timeout):
+        """Asynchronously yield events until the prompt finishes, raising on errors and timeouts"""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                event = await asyncio.wait_for(self._events.get(), max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Prompt {self.prompt_id} did not finish within {timeout} seconds")
+            if isinstance(event, Exception):
+                raise event
+            yield event
+            if self.is_final(event):
+                return
+
+class WebsocketOutputCollector:
+    """Collects SaveImageWebsocket frames while their node is executing, passing every event on to on_event"""
+
+    def __init__(self, websocket_nodes, on_event=None):
+        self.websocket_nodes = websocket_nodes
+        self.on_event = on_event
+        self.outputs = {}
+        self.current_node = None
+
+    def __call__(self, event):
+        if isinstance(event, bytes):
+            if self.current_node in self.websocket_nodes:
+                self.outputs.setdefault(self.current_node, []).append(event[8:])  # Skip event and format headers
+        elif event['type'] == 'executing':
+            self.current_node = event['data'].get('node')
+        if self.on_event is not None:
+            self.on_event(event)
+
+def history_output_nodes(waiter):
+    """Output nodes of a started workflow whose files have to be fetched through /history"""
+    return [node_id for node_id, node in waiter.workflow.items()
+            if node['class_type'] in OUTPUT_NODES and node_id not in waiter.websocket_nodes]
+
 class ComfyUIClient:
     def __init__(self, server_address=SERVER_ADDRESS):
         self.server_address = server_address
         self.client_id = str(uuid.uuid4())
+        
+        # One websocket per backend; events are routed to waiters by prompt_id
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        self._listener = None
+        self._connected = threading.Event()
+        self._executing_prompt_id = None
+        
+        # Keep-alive connection pool for REST calls
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        self._session.mount('http://', self._adapter)
+        self._download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='comfy-download')
+        
+        # Content hash -> upload response for input images already on this backend
+        self._uploaded = OrderedDict()
+        self._uploads_lock = threading.Lock()
+        self.upload_hits = 0
+        self.upload_misses = 0
+        self.upload_bytes_saved = 0
+        
+        # Pending prompt positions from /queue, shared by all waiters until the next status message
+        self._queue_positions = None
+        self._queue_version = 0
+        self._queue_lock = threading.Lock()
+    
+    def _request(self, method, path, timeout=None, **kwargs):
+        """Send a request over the pooled keep-alive session"""
+        url = f"http://{self.server_address}{path}"
+        try:
+            response = self._session.request(
+                method, url,
+                timeout=timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                **kwargs
+            )
+        except requests.ConnectionError as e:
+            raise ConnectionError(f"Could not reach ComfyUI at {self.server_address}: {str(e)}") from e
+        except requests.Timeout as e:
+            raise TimeoutError(f"ComfyUI request {method} {path} timed out") from e
+        
+        if response.status_code >= 400:
+            try:
+                details = response.json()
+            except ValueError:
+                details = None
+            raise ComfyUIExecutionError(
+                f"ComfyUI returned {response.status_code} for {method} {path}: {response.text[:500]}",
+                response.status_code, details
+            )
+        return response
+    
+    def pool_stats(self):
+        """Report how often requests reused a pooled connection"""
+        reused = new = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new += pool.num_connections
+            reused += pool.num_requests - pool.num_connections
+        total = reused + new
+        return {
+            'pool_size': HTTP_POOL_SIZE,
+            'requests': total,
+            'hits': reused,
+            'misses': new,
+            'hit_rate': round(reused / total, 3) if total else None
+        }
     
-    def queue_prompt(self, prompt, prompt_id):
+    def queue_prompt(self, prompt, prompt_id, timeout=None):
         """Queue a prompt for execution"""
         p = {"prompt": prompt, "client_id": self.client_id, "prompt_id": prompt_id}
         data = json.dumps(p).encode('utf-8')
-        req = urllib.request.Request(f"http://{self.server_address}/prompt", data=data)
-        urllib.request.urlopen(req).read()
+        return self._request('POST', '/prompt', data=data, timeout=timeout,
+                             headers={'Content-Type': 'application/json'}).json()
     
-    def get_image(self, filename, subfolder, folder_type):
+    def get_image(self, filename, subfolder, folder_type, timeout=None):
         """Get image from ComfyUI server"""
         data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-        url_values = urllib.parse.urlencode(data)
-        with urllib.request.urlopen(f"http://{self.server_address}/view?{url_values}") as response:
-            return response.read()
+        return self._request('GET', '/view', params=data, timeout=timeout).content
     
-    def get_history(self, prompt_id):
+    def get_history(self, prompt_id, timeout=None):
         """Get execution history for a prompt"""
-        with urllib.request.urlopen(f"http://{self.server_address}/history/{prompt_id}") as response:
-            return json.loads(response.read())
+        return self._request('GET', f'/history/{prompt_id}', timeout=timeout).json()
     
-    def upload_image(self, image_data, filename):
-        """Upload image to ComfyUI server"""
+    def upload_image(self, image_data, filename, timeout=None):
+        """Upload image to ComfyUI server, skipping the upload when the same bytes are already there"""
+        digest = hashlib.sha256(image_data).hexdigest()
+        with self._uploads_lock:
+            uploaded = self._uploaded.get(digest)
+            if uploaded is not None:
+                self._uploaded.move_to_end(digest)
+                self.upload_hits += 1
+                self.upload_bytes_saved += len(image_data)
+                return uploaded
+        
+        # Name the file after its content so repeated uploads map to the same input file
+        mimetype, extension = detect_image_type(image_data)
+        name = f"{digest[:32]}.{extension}"
+        
         # Create multipart form data
         boundary = '----WebKitFormBoundary' + ''.join(random.choices('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ', k=16))
         
         body = f'--{boundary}\r\n'
-        body += f'Content-Disposition: form-data; name="image"; filename="{filename}"\r\n'
-        body += 'Content-Type: image/jpeg\r\n\r\n'
+        body += 'Content-Disposition: form-data; name="overwrite"\r\n\r\ntrue\r\n'
+        body += f'--{boundary}\r\n'
+        body += f'Content-Disposition: form-data; name="image"; filename="{name}"\r\n'
+        body += f'Content-Type: {mimetype}\r\n\r\n'
         body = body.encode('utf-8') + image_data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
         
-        req = urllib.request.Request(
-            f"http://{self.server_address}/upload/image",
+        uploaded = self._request(
+            'POST', '/upload/image',
             data=body,
-            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
-        )
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+            timeout=timeout
+        ).json()
+        logger.info(f"Uploaded {filename} to ComfyUI as {uploaded['name']} ({mimetype}, {len(image_data)} bytes)")
         
-        with urllib.request.urlopen(req) as response:
-            return json.loads(response.read())
+        with self._uploads_lock:
+            self.upload_misses += 1
+            self._uploaded[digest] = uploaded
+            while len(self._uploaded) > UPLOAD_REGISTRY_SIZE:
+                self._uploaded.popitem(last=False)
+        return uploaded
     
-    def execute_workflow(self, workflow):
-        """Execute a workflow and return the generated images and videos"""
-        prompt_id = str(uuid.uuid4())
+    def forget_upload(self, image_data):
+        """Drop an image from the upload registry so the next upload_image sends it again"""
+        with self._uploads_lock:
+            self._uploaded.pop(hashlib.sha256(image_data).hexdigest(), None)
+    
+    def clear_uploads(self):
+        """Forget every registered upload, e.g. after the server may have restarted with a clean input folder"""
+        with self._uploads_lock:
+            self._uploaded.clear()
+    
+    def upload_stats(self):
+        """Report how many uploads were skipped because the backend already had the file"""
+        with self._uploads_lock:
+            return {
+                'registered_files': len(self._uploaded),
+                'uploads': self.upload_misses,
+                'skipped': self.upload_hits,
+                'bytes_saved': self.upload_bytes_saved
+            }
+    
+    def interrupt(self, timeout=5, prompt_id=None):
+        """Interrupt the prompt ComfyUI is currently executing, or only prompt_id if it is the one executing"""
+        self._request('POST', '/interrupt', json={'prompt_id': prompt_id} if prompt_id else None, timeout=timeout)
+    
+    def interrupt_prompt(self, prompt_id, timeout=5):
+        """Interrupt prompt_id only if it is the prompt ComfyUI is executing; returns whether it was"""
+        comfy_queue = self.get_queue(timeout)
+        if not any(item[1] == prompt_id for item in comfy_queue.get('queue_running', [])):
+            return False
+        self.interrupt(timeout, prompt_id)
+        return True
+    
+    def has_prompt(self, prompt_id):
+        """Check whether a prompt queued through this client is still being waited for"""
+        with self._waiters_lock:
+            return prompt_id in self._waiters
+    
+    def cancel_prompt(self, waiter, timeout=5):
+        """Delete a queued prompt from ComfyUI, or interrupt it if it is executing, and fail its waiter"""
+        prompt_id = waiter.prompt_id
+        comfy_queue = self.get_queue(timeout)
+        if any(item[1] == prompt_id for item in comfy_queue.get('queue_pending', [])):
+            self._request('POST', '/queue', json={'delete': [prompt_id]}, timeout=timeout)
+        elif any(item[1] == prompt_id for item in comfy_queue.get('queue_running', [])):
+            self.interrupt(timeout, prompt_id)
+        # ComfyUI sends no event for a deleted prompt, so the wait is ended here
+        waiter.fail(GenerationCancelled(f"Prompt {prompt_id} was cancelled"))
+    
+    def get_system_stats(self, timeout=5):
+        """Get ComfyUI system and device information"""
+        return self._request('GET', '/system_stats', timeout=timeout).json()
+    
+    def get_queue(self, timeout=5):
+        """Get the running and pending prompts in ComfyUI's queue"""
+        return self._request('GET', '/queue', timeout=timeout).json()
+    
+    def get_queue_positions(self):
+        """Map each pending prompt id to the number of prompts ahead of it, reading /queue once per status change"""
+        with self._queue_lock:
+            version = self._queue_version
+            if self._queue_positions is not None and self._queue_positions[0] == version:
+                return self._queue_positions[1]
+            comfy_queue = self.get_queue()
+            
+            # Queue entries are [number, prompt_id, ...]; lower numbers run first
+            running = comfy_queue.get('queue_running', [])
+            pending = sorted(comfy_queue.get('queue_pending', []), key=lambda item: item[0])
+            positions = {item[1]: len(running) + index for index, item in enumerate(pending)}
+            self._queue_positions = (version, positions)
+            return positions
+    
+    def submit_workflow(self, workflow, waiter=None):
+        """Register a waiter and queue a workflow, returning the waiter for its events"""
+        self._ensure_listener()
         
-        # Connect to websocket
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
+        waiter = waiter or PromptWaiter(str(uuid.uuid4()))
+        prompt_id = waiter.prompt_id
+        with self._waiters_lock:
+            self._waiters[prompt_id] = waiter
         
         try:
             # Queue the prompt
             self.queue_prompt(workflow, prompt_id)
-            
-            # Wait for execution to complete
-            output_images = {}
-            while True:
-                out = ws.recv()
-                if isinstance(out, str):
-                    message = json.loads(out)
-                    if message['type'] == 'executing':
-                        data = message['data']
-                        if data['node'] is None and data['prompt_id'] == prompt_id:
-                            break  # Execution is done
-                else:
-                    continue  # Skip binary data (previews)
-            
-            # Get the results from history
-            history = self.get_history(prompt_id)[prompt_id]
-            logger.info(f"Workflow execution completed. History keys: {list(history.keys())}")
-            logger.info(f"Output nodes: {list(history['outputs'].keys())}")
-            
-            # Extract images and videos from the results
-            for node_id in history['outputs']:
-                node_output = history['outputs'][node_id]
-                logger.info(f"Node {node_id} output keys: {list(node_output.keys())}")
-                
-                # Handle images, videos, and gifs
-                if 'images' in node_output:
-                    images_output = []
-                    for image in node_output['images']:
-                        logger.info(f"Processing image: {image['filename']} from {image['subfolder']}")
-                        image_data = self.get_image(image['filename'], image['subfolder'], image['type'])
-                        images_output.append(image_data)
-                    output_images[node_id] = images_output
-                elif 'videos' in node_output:
-                    videos_output = []
-                    for video in node_output['videos']:
-                        logger.info(f"Processing video: {video['filename']} from {video['subfolder']}")
-                        video_data = self.get_image(video['filename'], video['subfolder'], video['type'])
-                        videos_output.append(video_data)
-                    output_images[node_id] = videos_output
-                elif 'gifs' in node_output:
-                    gifs_output = []
-                    for gif in node_output['gifs']:
-                        logger.info(f"Processing gif: {gif['filename']} from {gif['subfolder']}")
-                        gif_data = self.get_image(gif['filename'], gif['subfolder'], gif['type'])
-                        gifs_output.append(gif_data)
-                    output_images[node_id] = gifs_output
-            
-            logger.info(f"Final output_images keys: {list(output_images.keys())}")
-            return output_images
-            
+        except Exception:
+            self._release_waiter(waiter)
+            raise
+        return waiter
+    
+    def wait_for_completion(self, waiter, timeout=EXECUTION_TIMEOUT, on_event=None):
+        """Block until the waiter's prompt finishes, passing each event to on_event"""
+        try:
+            for event in waiter.events(timeout):
+                if on_event is not None:
+                    on_event(event)
         finally:
-            ws.close()
-
-# Initialize ComfyUI client
-comfy_client = ComfyUIClient()
-
-# Load workflow templates
-def load_workflow_template(filename):
-    """Load workflow template from JSON file"""
-    with open(filename, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-# Load the workflow templates
-FLUX_WORKFLOW_PATH = "c:\\Users\\Asus\\Desktop\\Illustrify\\image-gen-worflows\\Flux-KREA-Image-Gen.json"
-EDIT_WORKFLOW_PATH = "c:\\Users\\Asus\\Desktop\\Illustrify\\image-gen-worflows\\Image-Edit-Workflow.json"
-I2V_WORKFLOW_PATH = "c:\\Users\\Asus\\Desktop\\Illustrify\\image-gen-worflows\\Image-To-Video.json"
-
-flux_workflow_template = load_workflow_template(FLUX_WORKFLOW_PATH)
-edit_workflow_template = load_workflow_template(EDIT_WORKFLOW_PATH)
-i2v_workflow_template = load_workflow_template(I2V_WORKFLOW_PATH)
-
-@app.route('/generate-image', methods=['POST'])
-@handle_errors
-def generate_image():
-    """Generate image using Flux-KREA workflow"""
-    try:
-        data = request.get_json()
+            self._release_waiter(waiter)
+    
+    def get_outputs(self, prompt_id, skip_nodes=()):
+        """Download the images and videos a finished prompt produced"""
+        output_images = {}
         
-        # Extract and validate parameters from request
-        prompt = validate_prompt(data.get('prompt', 'A beautiful landscape'))
-        negative_prompt = validate_prompt(data.get('negative_prompt', 'Blurry, bad quality'))
-        width = int(data.get('width', 1024))
-        height = int(data.get('height', 1024))
-        steps = int(data.get('steps', 20))
-        cfg = float(data.get('cfg', 1))
-        seed = int(data.get('seed', random.randint(1, 2**32)))
+        # Get the results from history
+        history = self.get_history(prompt_id)[prompt_id]
+        logger.info(f"Workflow execution completed. History keys: {list(history.keys())}")
+        logger.info(f"Output nodes: {list(history['outputs'].keys())}")
         
-        # Validate parameters
-        validate_image_params(width, height, steps, cfg)
+        # Extract images and videos from the results
+        downloads = []
+        for node_id in history['outputs']:
+            if node_id in skip_nodes:
+                continue
+            node_output = history['outputs'][node_id]
+            logger.info(f"Node {node_id} output keys: {list(node_output.keys())}")
+            
+            # Handle images, videos, and gifs
+            for kind in ('images', 'videos', 'gifs'):
+                if kind in node_output:
+                    output_images[node_id] = []
+                    downloads.extend((node_id, kind, item) for item in node_output[kind])
+                    break
         
-        # Create a copy of the workflow template
-        workflow = flux_workflow_template.copy()
+        def download(entry):
+            node_id, kind, item = entry
+            logger.info(f"Processing {kind[:-1]}: {item['filename']} from {item['subfolder']}")
+            return self.get_image(item['filename'], item['subfolder'], item['type'])
         
-        # Modify workflow parameters
-        # Update positive prompt (node 100)
-        workflow["100"]["inputs"]["text"] = prompt
+        # Fetch all files in parallel; map() keeps them in history order
+        if len(downloads) == 1:
+            results = [download(downloads[0])]
+        else:
+            results = self._download_pool.map(download, downloads)
+        for (node_id, _, _), data in zip(downloads, results):
+            output_images[node_id].append(data)
         
-        # Update negative prompt (node 139)
-        workflow["139"]["inputs"]["text"] = negative_prompt
+        logger.info(f"Final output_images keys: {list(output_images.keys())}")
+        return output_images
+    
+    def start_workflow(self, workflow, retrieval=OUTPUT_RETRIEVAL):
+        """Queue a workflow without waiting; pass the returned waiter to finish_workflow"""
+        websocket_nodes = set()
+        if retrieval == 'websocket':
+            workflow, websocket_nodes = use_websocket_outputs(workflow)
         
-        # Update image dimensions (node 136)
-        workflow["136"]["inputs"]["width"] = width
-        workflow["136"]["inputs"]["height"] = height
+        waiter = self.submit_workflow(workflow)
+        waiter.workflow = workflow
+        waiter.websocket_nodes = websocket_nodes
+        return waiter
+    
+    def finish_workflow(self, waiter, on_event=None):
+        """Wait for a started workflow and return its images and videos"""
+        websocket_nodes = waiter.websocket_nodes
         
-        # Update sampling parameters (node 137)
-        workflow["137"]["inputs"]["seed"] = seed
-        workflow["137"]["inputs"]["steps"] = steps
-        workflow["137"]["inputs"]["cfg"] = cfg
+        # Collect SaveImageWebsocket frames while their node is executing
+        collector = WebsocketOutputCollector(websocket_nodes, on_event)
         
-        # Execute the workflow
-        output_images = comfy_client.execute_workflow(workflow)
-        
-        # Convert images to base64 for response
-        result_images = []
-        for node_id, images in output_images.items():
-            for image_data in images:
-                # Convert to base64
-                image_b64 = base64.b64encode(image_data).decode('utf-8')
-                result_images.append({
-                    'image': image_b64,
-                    'format': 'png'
-                })
+        # Wait for execution to complete
+        self.wait_for_completion(waiter, on_event=collector)
         
-        return jsonify({
-            'success': True,
-            'images': result_images,
-            'parameters': {
-                'prompt': prompt,
-                'negative_prompt': negative_prompt,
-                'width': width,
-                'height': height,
-                'steps': steps,
-                'cfg': cfg,
-                'seed': seed
-            }
-        })
+        if not websocket_nodes:
+            return self.get_outputs(waiter.prompt_id)
         
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
-@app.route('/image-to-video', methods=['POST'])
-@handle_errors
-def image_to_video():
-    """Generate video from image using Image-To-Video workflow"""
-    try:
-        # Handle both JSON and form data
-        if request.content_type and 'multipart/form-data' in request.content_type:
-            # Handle file upload
-            if 'image' not in request.files:
-                return jsonify({'success': False, 'error': 'No image file provided'}), 400
-            
-            image_file = request.files['image']
-            prompt = request.form.get('prompt', '')
-            negative_prompt = request.form.get('negative_prompt', '色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量，JPEG压缩残留，丑陋的，残缺的，多余的手指，画得不好的手部，画得不好的脸部，畸形的，毁容的，形态畸形的肢体，手指融合，静止不动的画面，杂乱的背景，三条腿，背景人很多，倒着走')
-            width = int(request.form.get('width', 480))
-            height = int(request.form.get('height', 832))
-            length = int(request.form.get('length', 81))
-            steps = int(request.form.get('steps', 6))
-            cfg = float(request.form.get('cfg', 1))
-            seed = int(request.form.get('seed', random.randint(1, 2**32)))
-            frame_rate = int(request.form.get('frame_rate', 32))
-            
-            # Read image data
-            image_data = image_file.read()
-            filename = image_file.filename or 'uploaded_image.jpg'
-            
-        else:
-            # Handle base64 encoded image in JSON
-            data = request.get_json()
-            
-            if 'image' not in data:
-                return jsonify({'success': False, 'error': 'No image data provided'}), 400
-            
-            # Decode base64 image
+        # Only go through /history when some outputs (e.g. videos) cannot be sent over the websocket
+        output_images = collector.outputs
+        if history_output_nodes(waiter):
+            output_images.update(self.get_outputs(waiter.prompt_id, skip_nodes=websocket_nodes))
+        logger.info(f"Received websocket outputs from nodes: {sorted(websocket_nodes & output_images.keys())}")
+        return output_images
+    
+    def execute_workflow(self, workflow, on_event=None, retrieval=OUTPUT_RETRIEVAL):
+        """Execute a workflow and return the generated images and videos"""
+        waiter = self.start_workflow(workflow, retrieval)
+        return self.finish_workflow(waiter, on_event)
+    
+    # Shared websocket listener
+    def _ensure_listener(self):
+        """Start the background websocket listener and wait until it is connected"""
+        with self._waiters_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen,
+                    name=f"comfy-ws-{self.server_address}",
+                    daemon=True
+                )
+                self._listener.start()
+        
+        if not self._connected.wait(WS_CONNECT_TIMEOUT):
+            raise ConnectionError(f"Could not open websocket to ComfyUI at {self.server_address}")
+    
+    def _listen(self):
+        """Receive events from ComfyUI forever, reconnecting when the socket drops"""
+        disconnected_at = time.time()
+        while True:
+            ws = websocket.WebSocket()
             try:
-                image_b64 = data['image']
-                if ',' in image_b64:  # Remove data URL prefix if present
-                    image_b64 = image_b64.split(',')[1]
-                image_data = base64.b64decode(image_b64)
+                ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}", timeout=WS_CONNECT_TIMEOUT)
+                ws.settimeout(None)
             except Exception as e:
-                return jsonify({'success': False, 'error': f'Invalid image data: {str(e)}'}), 400
-            
-            prompt = data.get('prompt', '')
-            negative_prompt = data.get('negative_prompt', '色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量，JPEG压缩残留，丑陋的，残缺的，多余的手指，画得不好的手部，画得不好的脸部，畸形的，毁容的，形态畸形的肢体，手指融合，静止不动的画面，杂乱的背景，三条腿，背景人很多，倒着走')
-            width = data.get('width', 480)
-            height = data.get('height', 832)
-            length = data.get('length', 81)
-            steps = data.get('steps', 6)
-            cfg = data.get('cfg', 1.0)
-            seed = data.get('seed', random.randint(1, 2**32))
-            frame_rate = data.get('frame_rate', 32)
-            filename = data.get('filename', 'uploaded_image.jpg')
-        
-        # Upload image to ComfyUI server
-        upload_result = comfy_client.upload_image(image_data, filename)
-        uploaded_filename = upload_result['name']
-        
-        # Create a copy of the workflow template
-        workflow = i2v_workflow_template.copy()
-        
-        # Modify workflow parameters
-        # Update the image input (node 91)
-        workflow["91"]["inputs"]["image"] = uploaded_filename
-        
-        # Update positive prompt (node 88)
-        workflow["88"]["inputs"]["text"] = prompt
-        
-        # Update negative prompt (node 86)
-        workflow["86"]["inputs"]["text"] = negative_prompt
-        
-        # Update video dimensions and length (node 89)
-        workflow["89"]["inputs"]["width"] = width
-        workflow["89"]["inputs"]["height"] = height
-        workflow["89"]["inputs"]["length"] = length
-        
-        # Update sampling parameters (nodes 81 and 82)
-        workflow["81"]["inputs"]["noise_seed"] = seed
-        workflow["81"]["inputs"]["steps"] = steps
-        workflow["81"]["inputs"]["cfg"] = cfg
-        
-        workflow["82"]["inputs"]["noise_seed"] = seed + 1
-        workflow["82"]["inputs"]["steps"] = steps
-        workflow["82"]["inputs"]["cfg"] = cfg
-        
-        # Update video output settings (node 62)
-        workflow["62"]["inputs"]["frame_rate"] = frame_rate
-        
-        # Execute the workflow
-        logger.info(f"Executing image-to-video workflow with prompt: '{prompt}'")
-        output_images = comfy_client.execute_workflow(workflow)
-        
-        # Print detailed ComfyUI response for debugging
-        logger.info("=== COMFYUI RESPONSE DEBUG ===")
-        logger.info(f"Raw result type: {type(output_images)}")
-        logger.info(f"Raw result: {output_images}")
-        
-        if output_images:
-            logger.info(f"Result keys: {list(output_images.keys())}")
-            for key, value in output_images.items():
-                logger.info(f"Key '{key}': type={type(value)}, value={value}")
-                if isinstance(value, list):
-                    logger.info(f"  List length: {len(value)}")
-                    for i, item in enumerate(value):
-                        logger.info(f"    Item {i}: type={type(item)}, length={len(item) if hasattr(item, '__len__') else 'N/A'}")
-        logger.info("=== END COMFYUI RESPONSE DEBUG ===")
-        
-        logger.info(f"Workflow execution completed. Output nodes: {list(output_images.keys())}")
-        
-        # The video output should be in node 62 (VHS_VideoCombine)
-        # But since ComfyUI returns images, we need to handle video files differently
-        # For now, we'll return the generated frames and let the client handle video creation
-        result_videos = []
-        result_frames = []
-        
-        for node_id, images in output_images.items():
-            logger.info(f"Processing node {node_id} with {len(images)} outputs")
-            if node_id == "62":  # Video output node
-                # This should contain the video file, but ComfyUI API might return frames
-                for i, image_data in enumerate(images):
-                    logger.info(f"Processing video output {i+1}/{len(images)}, size: {len(image_data)} bytes")
-                    # Check if this is actually a video file or frames
-                    video_b64 = base64.b64encode(image_data).decode('utf-8')
-                    result_videos.append({
-                        'video': video_b64,
-                        'format': 'mp4'
-                    })
-            else:
-                # These are intermediate frames
-                for i, image_data in enumerate(images):
-                    logger.info(f"Processing frame {i+1}/{len(images)} from node {node_id}, size: {len(image_data)} bytes")
-                    frame_b64 = base64.b64encode(image_data).decode('utf-8')
-                    result_frames.append({
-                        'image': frame_b64,
-                        'format': 'png'
-                    })
-        
-        logger.info(f"Final result: {len(result_videos)} videos, {len(result_frames)} frames")
-        
-        return jsonify({
-            'success': True,
-            'videos': result_videos,
-            'frames': result_frames,
-            'parameters': {
-                'prompt': prompt,
-                'negative_prompt': negative_prompt,
-                'width': width,
-                'height': height,
-                'length': length,
-                'steps': steps,
-                'cfg': cfg,
-                'seed': seed,
-                'frame_rate': frame_rate,
-                'original_filename': filename
-            }
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
-@app.route('/edit-image', methods=['POST'])
-@handle_errors
-def edit_image():
-    """Edit image using Qwen Image Edit workflow"""
-    try:
-        # Handle both JSON and form data
-        if request.content_type and 'multipart/form-data' in request.content_type:
-            # Handle file upload
-            if 'image' not in request.files:
-                return jsonify({'success': False, 'error': 'No image file provided'}), 400
-            
-            image_file = request.files['image']
-            prompt = request.form.get('prompt', '')
-            negative_prompt = request.form.get('negative_prompt', '')
-            steps = int(request.form.get('steps', 4))
-            cfg = float(request.form.get('cfg', 1))
-            seed = int(request.form.get('seed', random.randint(1, 2**32)))
-            
-            # Read image data
-            image_data = image_file.read()
-            filename = image_file.filename or 'uploaded_image.jpg'
-            
-        else:
-            # Handle base64 encoded image in JSON
-            data = request.get_json()
-            
-            if 'image' not in data:
-                return jsonify({'success': False, 'error': 'No image data provided'}), 400
+                if time.time() - disconnected_at > WS_RECONNECT_GRACE:
+                    self._fail_waiters(ConnectionError(f"Lost websocket connection to ComfyUI at {self.server_address}: {str(e)}"))
+                time.sleep(WS_RECONNECT_DELAY)
+                continue
             
-            # Decode base64 image
+            logger.info(f"ComfyUI websocket listener connected to {self.server_address}")
+            self._connected.set()
+            self._resync_waiters()
             try:
-                image_b64 = data['image']
-                if ',' in image_b64:  # Remove data URL prefix if present
-                    image_b64 = image_b64.split(',')[1]
-                image_data = base64.b64decode(image_b64)
+                while True:
+                    self._dispatch(ws.recv())
             except Exception as e:
-                return jsonify({'success': False, 'error': f'Invalid image data: {str(e)}'}), 400
-            
-            prompt = data.get('prompt', '')
-            negative_prompt = data.get('negative_prompt', '')
-            steps = data.get('steps', 4)
-            cfg = data.get('cfg', 1.0)
-            seed = data.get('seed', random.randint(1, 2**32))
-            filename = data.get('filename', 'uploaded_image.jpg')
-        
-        # Upload image to ComfyUI server
-        upload_result = comfy_client.upload_image(image_data, filename)
-        uploaded_filename = upload_result['name']
-        
-        # Create a copy of the workflow template
-        workflow = edit_workflow_template.copy()
-        
-        # Modify workflow parameters
-        # Update the image input (node 105)
-        workflow["105"]["inputs"]["image"] = uploaded_filename
-        
-        # Update positive prompt (node 76)
-        workflow["76"]["inputs"]["prompt"] = prompt
-        
-        # Update negative prompt (node 77)
-        workflow["77"]["inputs"]["prompt"] = negative_prompt
-        
-        # Update sampling parameters (node 3)
-        workflow["3"]["inputs"]["seed"] = seed
-        workflow["3"]["inputs"]["steps"] = steps
-        workflow["3"]["inputs"]["cfg"] = cfg
-        
-        # Execute the workflow
-        output_images = comfy_client.execute_workflow(workflow)
-        
-        # Convert images to base64 for response
-        result_images = []
-        for node_id, images in output_images.items():
-            for image_data in images:
-                # Convert to base64
-                image_b64 = base64.b64encode(image_data).decode('utf-8')
-                result_images.append({
-                    'image': image_b64,
-                    'format': 'png'
-                })
-        
-        return jsonify({
-            'success': True,
-            'images': result_images,
-            'parameters': {
-                'prompt': prompt,
-                'negative_prompt': negative_prompt,
-                'steps': steps,
-                'cfg': cfg,
-                'seed': seed,
-                'original_filename': filename
-            }
-        })
+                logger.warning(f"ComfyUI websocket to {self.server_address} dropped: {str(e)}")
+            finally:
+                self._connected.clear()
+                self._executing_prompt_id = None
+                disconnected_at = time.time()
+                ws.close()
+    
+    def _dispatch(self, out):
+        """Route one websocket frame to the waiter of the prompt it belongs to"""
+        if isinstance(out, str):
+            message = json.loads(out)
+            data = message.get('data') or {}
+            prompt_id = data.get('prompt_id')
+            if message['type'] == 'executing':
+                self._executing_prompt_id = prompt_id if data.get('node') is not None else None
+        else:
+            # Binary frames (previews) carry no prompt id, they belong to the prompt being executed
+            message = out
+            prompt_id = self._executing_prompt_id
         
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        if isinstance(message, dict) and message['type'] == 'status':
+            # Queue size changes concern every prompt still waiting on this server
+            self._queue_version += 1
+            with self._waiters_lock:
+                waiters = list(self._waiters.values())
+            for waiter in waiters:
+                waiter.put(message)
+            return
+        if prompt_id is None:
+            return
+        with self._waiters_lock:
+            waiter = self._waiters.get(prompt_id)
+        if waiter is not None:
+            waiter.put(message)
+    
+    def _resync_waiters(self):
+        """Complete waiters whose prompts finished while the websocket was down"""
+        with self._waiters_lock:
+            waiters = list(self._waiters.values())
+        for waiter in waiters:
+            try:
+                if waiter.prompt_id in self.get_history(waiter.prompt_id):
+                    waiter.put({'type': 'executing', 'data': {'node': None, 'prompt_id': waiter.prompt_id}})
+            except Exception as e:
+                logger.warning(f"Could not resync prompt {waiter.prompt_id}: {str(e)}")
+    
+    def _fail_waiters(self, error):
+        with self._waiters_lock:
+            waiters = list(self._waiters.values())
+        for waiter in waiters:
+            waiter.fail(error)
+    
+    def _release_waiter(self, waiter):
+        with self._waiters_lock:
+            self._waiters.pop(waiter.prompt_id, None)
 
-@app.route('/interrupt', methods=['POST'])
-@handle_errors
-def interrupt_generation():
-    """Interrupt current generation in ComfyUI"""
-    try:
-        # Send interrupt request to ComfyUI server
-        req = urllib.request.Request(f"http://{SERVER_ADDRESS}/interrupt", method='POST')
-        with urllib.request.urlopen(req, timeout=5) as response:
-            result = response.read()
+class AsyncComfyUIClient:
+    """asyncio interface to a ComfyUI server, sharing the websocket listener of a ComfyUIClient
+
+    REST calls run on a small thread pool and return as soon as ComfyUI answers. Waiting for a
+    prompt is an awaited queue fed by the listener thread, so a pending generation costs a
+    coroutine and a waiter object rather than a blocked OS thread.
+    """
+
+    def __init__(self, client, executor):
+        self.client = client
+        self.server_address = client.server_address
+        self._executor = executor
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def queue_prompt(self, prompt, prompt_id, timeout=None):
+        """Queue a prompt for execution"""
+        return await self._call(self.client.queue_prompt, prompt, prompt_id, timeout)
+
+    async def upload_image(self, image_data, filename, timeout=None):
+        """Upload image to ComfyUI server, skipping the upload when the same bytes are already there"""
+        return await self._call(self.client.upload_image, image_data, filename, timeout)
+
+    async def get_image(self, filename, subfolder, folder_type):
+        """Get an output file from ComfyUI"""
+        return await self._call(self.client.get_image, filename, subfolder, folder_type)
+
+    async def get_history(self, prompt_id):
+        """Get the execution history of a prompt"""
+        return await self._call(self.client.get_history, prompt_id)
+
+    async def get_queue(self, timeout=5):
+        """Get the running and pending prompts in ComfyUI's queue"""
+        return await self._call(self.client.get_queue, timeout)
+
+    async def interrupt(self, timeout=5):
+        """Interrupt the prompt ComfyUI is currently executing"""
+        return await self._call(self.client.interrupt, timeout)
+
+    async def submit_workflow(self, workflow):
+        """Register an async waiter and queue a workflow, returning the waiter for its events"""
+        waiter = AsyncPromptWaiter(str(uuid.uuid4()), asyncio.get_running_loop())
+        return await self._call(self.client.submit_workflow, workflow, waiter)
+
+    async def wait_for_completion(self, waiter, timeout=EXECUTION_TIMEOUT, on_event=None):
+        """Wait until the waiter's prompt finishes, passing each event to on_event
+
+        on_event runs on the thread pool because handlers may decode previews or call ComfyUI.
+        """
+        try:
+            async for event in waiter.events(timeout):
+                if on_event is not None:
+                    await self._call(on_event, event)
+        finally:
+            self.client._release_waiter(waiter)
+
+    async def get_outputs(self, prompt_id, skip_nodes=()):
+        """Download the images and videos a finished prompt produced"""
+        return await self._call(self.client.get_outputs, prompt_id, skip_nodes)
+
+    async def start_workflow(self, workflow, retrieval=OUTPUT_RETRIEVAL):
+        """Queue a workflow without waiting; pass the returned waiter to finish_workflow"""
+        websocket_nodes = set()
+        if retrieval == 'websocket':
+            workflow, websocket_nodes = use_websocket_outputs(workflow)
         
-        return jsonify({
-            'success': True,
-            'message': 'Generation interrupted successfully'
-        })
+        waiter = await self.submit_workflow(workflow)
+        waiter.workflow = workflow
+        waiter.websocket_nodes = websocket_nodes
+        return waiter
+
+    async def finish_workflow(self, waiter, on_event=None):
+        """Wait for a started workflow and return its images and videos"""
+        collector = WebsocketOutputCollector(waiter.websocket_nodes, on_event)
+        await self.wait_for_completion(waiter, on_event=collector)
         
-    except Exception as e:
-        logger.error(f"Failed to interrupt generation: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': f'Failed to interrupt generation: {str(e)}'
-        }), 500
+        if not waiter.websocket_nodes:
+            return await self.get_outputs(waiter.prompt_id)
+        output_images = collector.outputs
+        if history_output_nodes(waiter):
+            output_images.update(await self.get_outputs(waiter.prompt_id, skip_nodes=waiter.websocket_nodes))
+        return output_images
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    try:
-        # Test connection to ComfyUI server
-        test_req = urllib.request.Request(f"http://{SERVER_ADDRESS}/system_stats")
-        with urllib.request.urlopen(test_req, timeout=5) as response:
-            comfy_status = "connected"
-    except:
-        comfy_status = "disconnected"
-    
-    return jsonify({
-        "status": "healthy",
-        "message": "ComfyUI Flask API is running",
-        "comfyui_status": comfy_status,
-        "server_address": SERVER_ADDRESS
-    })
+    async def execute_workflow(self, workflow, on_event=None, retrieval=OUTPUT_RETRIEVAL):
+        """Execute a workflow and return the generated images and videos"""
+        waiter = await self.start_workflow(workflow, retrieval)
+        return await self.finish_workflow(waiter, on_event)
 
-@app.route('/workflows', methods=['GET'])
-def list_workflows():
-    """List available workflows"""
-    return jsonify({
-        "workflows": [
-            {
-                "name": "flux-krea-image-gen",
-                "description": "Generate images using Flux-KREA model",
-                "endpoint": "/generate-image",
-                "method": "POST",
-                "parameters": {
-                    "prompt": "string (required)",
-                    "negative_prompt": "string (optional)",
-                    "width": "integer (64-2048, default: 1024)",
-                    "height": "integer (64-2048, default: 1024)",
-                    "steps": "integer (1-100, default: 20)",
-                    "cfg": "float (0.1-30, default: 1)",
-                    "seed": "integer (optional, random if not provided)"
-                }
-            },
-            {
-                "name": "qwen-image-edit",
-                "description": "Edit images using Qwen Image Edit model",
-                "endpoint": "/edit-image",
-                "method": "POST",
-                "parameters": {
-                    "image": "file or base64 string (required)",
-                    "prompt": "string (optional)",
-                    "negative_prompt": "string (optional)",
-                    "steps": "integer (1-100, default: 4)",
-                    "cfg": "float (0.1-30, default: 1)",
-                    "seed": "integer (optional, random if not provided)"
-                }
-            },
-            {
-                "name": "wan-image-to-video",
-                "description": "Generate video from image using WAN Image-To-Video model",
-                "endpoint": "/image-to-video",
-                "method": "POST",
-                "parameters": {
-                    "image": "file or base64 string (required)",
-                    "prompt": "string (required)",
-                    "negative_prompt": "string (optional)",
-                    "width": "integer (default: 480)",
-                    "height": "integer (default: 832)",
-                    "length": "integer (frames, default: 81)",
-                    "steps": "integer (1-100, default: 6)",
-                    "cfg": "float (0.1-30, default: 1)",
-                    "seed": "integer (optional, random if not provided)",
-                    "frame_rate": "integer (default: 32)"
-                }
+# Async serving mode: worker threads lent to coroutines for blocking ComfyUI REST calls
+async_io_pool = ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix='comfy-async-io')
+
+# Backend pool
+class ComfyUIBackend:
+    """A ComfyUI instance in the pool together with its routing and health state"""
+
+    def __init__(self, address):
+        self.client = ComfyUIClient(address)
+        self.async_client = AsyncComfyUIClient(self.client, async_io_pool)
+        self.healthy = True
+        self.failures = 0
+        self.queue_depth = 0
+        self.dispatched = 0  # Prompts sent since the last /queue poll
+        self.in_flight = 0
+        self.devices = []
+        self.last_checked = None
+        self.last_error = None
+        self.models = None  # Model set of the last prompt queued here, which ComfyUI keeps loaded
+
+    @property
+    def address(self):
+        return self.client.server_address
+
+    @property
+    def load(self):
+        return self.queue_depth + self.dispatched
+
+    def to_dict(self):
+        return {
+            'address': self.address,
+            'healthy': self.healthy,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'consecutive_failures': self.failures,
+            'last_checked': self.last_checked,
+            'last_error': self.last_error,
+            'devices': self.devices,
+            'http_pool': self.client.pool_stats(),
+            'uploads': self.client.upload_stats()
+        }
+
+class BackendPool:
+    """Routes each generation to the healthy ComfyUI backend with the shortest queue"""
+
+    def __init__(self, addresses=COMFYUI_BACKENDS, check_interval=BACKEND_CHECK_INTERVAL, max_failures=BACKEND_MAX_FAILURES):
+        self.backends = [ComfyUIBackend(address) for address in addresses]
+        self.check_interval = check_interval
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._monitor = threading.Thread(target=self._monitor_loop, name='comfy-backend-monitor', daemon=True)
+        self._monitor.start()
+
+    def select(self, models=None, exclude=()):
+        """Pick the least loaded healthy backend, preferring one that last ran the same models on a tie"""
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.healthy and backend not in exclude]
+            if not candidates:
+                raise ConnectionError('No healthy ComfyUI backend is available')
+            backend = min(candidates, key=lambda b: (b.load, models is not None and b.models != models, b.in_flight))
+            backend.dispatched += 1
+            backend.in_flight += 1
+            if models is not None:
+                backend.models = models
+            return backend
+
+    def loaded_models(self):
+        """Model sets the healthy backends last queued"""
+        with self._lock:
+            return {backend.models for backend in self.backends if backend.healthy and backend.models is not None}
+
+    def release(self, backend, error=None):
+        """Return a backend after use, counting connection failures towards ejection"""
+        with self._lock:
+            backend.in_flight -= 1
+        if isinstance(error, ConnectionError):
+            self._record_failure(backend, error)
+
+    def check(self, backend):
+        """Poll a backend's /queue and /system_stats and update its health"""
+        try:
+            queue_info = backend.client.get_queue()
+            system_stats = backend.client.get_system_stats()
+        except Exception as e:
+            self._record_failure(backend, e)
+            return
+        with self._lock:
+            backend.queue_depth = len(queue_info.get('queue_running', [])) + len(queue_info.get('queue_pending', []))
+            backend.dispatched = 0
+            backend.devices = system_stats.get('devices', [])
+            backend.last_checked = time.time()
+            backend.last_error = None
+            backend.failures = 0
+            if not backend.healthy:
+                backend.healthy = True
+                backend.client.clear_uploads()
+                logger.info(f"ComfyUI backend {backend.address} is healthy again, re-admitting it")
+
+    def stats(self):
+        return [backend.to_dict() for backend in self.backends]
+
+    def _record_failure(self, backend, error):
+        with self._lock:
+            backend.failures += 1
+            backend.last_error = str(error)
+            backend.last_checked = time.time()
+            if backend.healthy and backend.failures >= self.max_failures:
+                backend.healthy = False
+                logger.warning(f"Ejecting ComfyUI backend {backend.address} after {backend.failures} failures: {str(error)}")
+
+    def _monitor_loop(self):
+        while True:
+            for backend in self.backends:
+                self.check(backend)
+            time.sleep(self.check_interval)
+
+backend_pool = BackendPool()
+
+# Admission control and fair scheduling
+class QueueFullError(Exception):
+    """Raised when the scheduler queue is full; retry_after is a suggested wait in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionDeferred(Exception):
+    """Raised by start_generation for a job that missed the cache and must wait for a slot without holding its worker"""
+
+    def __init__(self, tickets):
+        super().__init__('Waiting for a generation slot')
+        self.tickets = tickets
+
+class GenerationCancelled(Exception):
+    """Raised for a generation whose job was cancelled with DELETE /jobs/<id>"""
+
+    def __init__(self, message='Job was cancelled'):
+        super().__init__(message)
+
+class SchedulerTicket:
+    """A request's place in the scheduler queue"""
+
+    def __init__(self, client_id, virtual_finish, models=None, request=None):
+        self.client_id = client_id
+        self.request = request if request is not None else self  # Shared by the prompts of one batch
+        self.virtual_finish = virtual_finish
+        self.models = models  # workflow_models() of the request's workflow
+        self.enqueued_at = time.time()
+        self.admitted_at = None
+        self.ready = False  # Set once a thread is actually waiting to run the request
+        self.released = False
+        self.cancelled = False  # Withdrawn because its job was cancelled
+        self.admitted = threading.Event()
+        self.settled = threading.Event()  # Set once the ticket is admitted or withdrawn
+        self.on_admit = None  # Called under the scheduler lock when the ticket is admitted or withdrawn
+
+class GenerationScheduler:
+    """Bounded, weighted-fair admission of generations into ComfyUI
+
+    Requests take one ticket per prompt when they arrive, so overload is rejected immediately
+    with a Retry-After hint. Waiting tickets are admitted one prompt at a time in order of their
+    virtual finish time (start-time fair queuing): each client's tickets are spaced by 1 / weight,
+    so the prompts of a long batch take turns with other clients' requests instead of pushing
+    them to the back of the queue. The per-client limit counts requests, so an idle server still
+    runs a batch's prompts side by side.
+    
+    Model affinity bends that order: when the next ticket needs models that no backend has
+    loaded, a later ticket reusing loaded models may go first, but only while the passed-over
+    ticket has waited less than affinity_window seconds.
+    """
+
+    def __init__(self, max_active=SCHEDULER_MAX_ACTIVE, max_queue=SCHEDULER_MAX_QUEUE,
+                 per_client=SCHEDULER_PER_CLIENT, weights=CLIENT_WEIGHTS,
+                 affinity_window=SCHEDULER_AFFINITY_WINDOW, loaded_models=None):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.weights = weights
+        self.affinity_window = affinity_window
+        self.loaded_models = loaded_models  # Returns the model sets the backends have loaded
+        self.admitted_count = 0
+        self.rejected_count = 0
+        self.model_switches = 0
+        self.switches_avoided = 0
+        self._last_models = None  # Model set of the last admitted ticket, before it reaches a backend
+        self._waiting = []
+        self._active = 0
+        self._client_requests = defaultdict(Counter)  # client -> admitted prompts per request
+        self._client_finish = {}
+        self._virtual_time = 0.0
+        self._seconds_per_prompt = 30.0  # Moving average used for Retry-After
+        self._lock = threading.Lock()
+
+    def enqueue(self, client_id, count=1, models=None):
+        """Reserve a place in the queue for a request of count prompts and return one ticket per prompt
+
+        Raises QueueFullError when SCHEDULER_MAX_QUEUE requests are already waiting.
+        """
+        with self._lock:
+            if len({ticket.request for ticket in self._waiting}) >= self.max_queue:
+                self.rejected_count += 1
+                raise QueueFullError('The generation queue is full, please retry later', self._retry_after())
+            
+            weight = self.weights.get(client_id, 1.0)
+            request = object() if count > 1 else None
+            tickets = []
+            for _ in range(count):
+                start = max(self._virtual_time, self._client_finish.get(client_id, 0.0))
+                ticket = SchedulerTicket(client_id, start + 1 / weight, models, request)
+                self._client_finish[client_id] = ticket.virtual_finish
+                self._waiting.append(ticket)
+                tickets.append(ticket)
+            return tickets
+
+    def acquire(self, ticket, timeout=EXECUTION_TIMEOUT):
+        """Block until the ticket is admitted; calling it again on an admitted ticket returns at once"""
+        with self._lock:
+            ticket.ready = True
+            self._dispatch()
+        if not ticket.settled.wait(timeout):
+            self.release(ticket)
+            raise TimeoutError(f"Request waited more than {timeout} seconds for a generation slot")
+        if ticket.cancelled:
+            raise GenerationCancelled()
+
+    async def acquire_async(self, ticket, timeout=EXECUTION_TIMEOUT):
+        """Wait for admission without blocking a thread"""
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+        def on_admit():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+        with self._lock:
+            ticket.on_admit = on_admit
+            ticket.ready = True
+            self._dispatch()
+            settled = ticket.settled.is_set()
+        if not settled:
+            try:
+                await asyncio.wait_for(admitted, timeout)
+            except asyncio.TimeoutError:
+                self.release(ticket)
+                raise TimeoutError(f"Request waited more than {timeout} seconds for a generation slot")
+        if ticket.cancelled:
+            raise GenerationCancelled()
+
+    def acquire_later(self, ticket, callback):
+        """Call callback() under the scheduler lock once the ticket is admitted or withdrawn, with nobody waiting on it"""
+        with self._lock:
+            if ticket.settled.is_set():
+                callback()  # Withdrawn before the job got around to waiting
+                return
+            ticket.on_admit = callback
+            ticket.ready = True
+            self._dispatch()
+
+    def cancel(self, ticket):
+        """Drop a ticket that is still waiting; returns False if it was already admitted or released"""
+        with self._lock:
+            if ticket.admitted.is_set() or ticket.released:
+                return False
+            ticket.released = True
+            self._waiting.remove(ticket)
+            self._dispatch()
+            return True
+
+    def withdraw(self, ticket):
+        """Cancel a waiting ticket and wake whoever waits on it with GenerationCancelled; returns False if it was already admitted or released"""
+        with self._lock:
+            if ticket.admitted.is_set() or ticket.released:
+                return False
+            ticket.released = True
+            ticket.cancelled = True
+            self._waiting.remove(ticket)
+            ticket.settled.set()
+            if ticket.on_admit is not None:
+                ticket.on_admit()
+            self._dispatch()
+            return True
+
+    def release(self, ticket):
+        """Free the ticket's slot, or drop it from the queue if it was never admitted"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            elif ticket.admitted.is_set():
+                self._active -= 1
+                requests = self._client_requests[ticket.client_id]
+                requests[ticket.request] -= 1
+                if not requests[ticket.request]:
+                    del requests[ticket.request]
+                if not requests:
+                    del self._client_requests[ticket.client_id]
+                elapsed = time.time() - ticket.admitted_at
+                self._seconds_per_prompt = 0.8 * self._seconds_per_prompt + 0.2 * elapsed
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self._active,
+                'max_active': self.max_active,
+                'queued': len(self._waiting),
+                'max_queue': self.max_queue,
+                'per_client_limit': self.per_client,
+                'active_clients': {client_id: sum(requests.values()) for client_id, requests in self._client_requests.items()},
+                'admitted': self.admitted_count,
+                'rejected': self.rejected_count,
+                'affinity_window': self.affinity_window,
+                'model_switches': self.model_switches,
+                'model_switches_avoided': self.switches_avoided
+            }
+
+    def _dispatch(self):
+        # Admit ready tickets in virtual finish order while there is capacity
+        while self._active < self.max_active:
+            eligible = [ticket for ticket in self._waiting if ticket.ready and self._client_allows(ticket)]
+            if not eligible:
+                return
+            ticket = min(eligible, key=lambda t: (t.virtual_finish, t.enqueued_at))
+            
+            # Let a ticket that reuses loaded models overtake one that would force a model switch
+            loaded = self._loaded()
+            if ticket.models is not None and ticket.models not in loaded:
+                if time.time() - ticket.enqueued_at < self.affinity_window:
+                    warm = [t for t in eligible if t.models in loaded]
+                    if warm:
+                        ticket = min(warm, key=lambda t: (t.virtual_finish, t.enqueued_at))
+                        self.switches_avoided += 1
+                        metrics.inc('illustrify_model_switches_avoided_total')
+            
+            if ticket.models is not None and ticket.models not in loaded:
+                self.model_switches += 1
+                metrics.inc('illustrify_model_switches_total')
+            if ticket.models is not None:
+                self._last_models = ticket.models
+            
+            self._waiting.remove(ticket)
+            self._active += 1
+            self._client_requests[ticket.client_id][ticket.request] += 1
+            self._virtual_time = max(self._virtual_time, ticket.virtual_finish - 1 / self.weights.get(ticket.client_id, 1.0))
+            self.admitted_count += 1
+            ticket.admitted_at = time.time()
+            ticket.admitted.set()
+            ticket.settled.set()
+            if ticket.on_admit is not None:
+                ticket.on_admit()
+
+    def _client_allows(self, ticket):
+        # More prompts of an already running request do not count against the per-client limit
+        requests = self._client_requests.get(ticket.client_id, {})
+        return ticket.request in requests or len(requests) < self.per_client
+
+    def _loaded(self):
+        loaded = set(self.loaded_models()) if self.loaded_models is not None else set()
+        if self._last_models is not None:
+            loaded.add(self._last_models)
+        return loaded
+
+    def _retry_after(self):
+        backlog = len(self._waiting) + self._active
+        return max(1, math.ceil(backlog * self._seconds_per_prompt / max(self.max_active, 1)))
+
+scheduler = GenerationScheduler(loaded_models=backend_pool.loaded_models)
+
+@metrics.collector
+def collect_pool_metrics():
+    """Scheduler and backend gauges, read at scrape time"""
+    stats = scheduler.stats()
+    samples = [
+        ('illustrify_scheduler_active', {}, stats['active']),
+        ('illustrify_scheduler_queued', {}, stats['queued'])
+    ]
+    for backend in backend_pool.stats():
+        labels = {'backend': backend['address']}
+        samples.append(('illustrify_backend_in_flight', labels, backend['in_flight']))
+        samples.append(('illustrify_backend_queue_depth', labels, backend['queue_depth']))
+        samples.append(('illustrify_backend_healthy', labels, int(backend['healthy'])))
+    return samples
+
+# Load workflow templates
+def load_workflow_template(filename):
+    """Load workflow template from JSON file"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Compiled workflow templates
+InputBinding = namedtuple('InputBinding', ['node', 'input', 'type', 'minimum', 'maximum', 'transform'],
+                          defaults=(None, None, None))
+InputBinding.__doc__ = """Where a request parameter goes in a workflow: node id, input name, type, allowed range and optional transform"""
+
+SEED_RANGE = (0, 2**64 - 1)
+
+def set_node_input(workflow, node_id, input_name, value):
+    """Set one input on a request's workflow, copying the node instead of mutating the shared template"""
+    node = workflow[node_id]
+    workflow[node_id] = {**node, 'inputs': {**node['inputs'], input_name: value}}
+
+def workflow_models(workflow):
+    """The models a workflow loads, as a hashable set of (loader class_type, loader settings)"""
+    return frozenset(
+        (node['class_type'], tuple(sorted((name, value) for name, value in node.get('inputs', {}).items()
+                                          if not isinstance(value, (list, dict)))))
+        for node in workflow.values() if is_loader_node(node.get('class_type')))
+
+class WorkflowTemplate:
+    """A workflow loaded once, with request parameters compiled into bindings to node inputs
+
+    The template itself is never modified. render() returns a new top-level dict in which only
+    the bound nodes (and their inputs dicts) are copies; every other node is shared read-only
+    with the template, so concurrent requests cannot see each other's parameters.
+    """
+
+    def __init__(self, name, workflow, bindings):
+        self.name = name
+        self.workflow = workflow
+        self.bindings = bindings
+        self.models = workflow_models(workflow)  # Bindings never touch loader nodes, so every render shares these
+        
+        # Check every binding against the workflow once, and group them by node for render()
+        self._nodes = {}
+        for param, targets in bindings.items():
+            for binding in targets:
+                node = workflow.get(binding.node)
+                if node is None or binding.input not in node.get('inputs', {}):
+                    raise ValueError(f"Workflow {name} has no input {binding.input!r} on node {binding.node}")
+                self._nodes.setdefault(binding.node, []).append((param, binding))
+
+    def validate(self, params):
+        """Coerce bound parameters to their types and check their ranges, returning a new params dict"""
+        params = dict(params)
+        for param, targets in self.bindings.items():
+            if param not in params:
+                raise ValueError(f"Missing parameter: {param}")
+            binding = targets[0]
+            try:
+                value = binding.type(params[param])
+            except (TypeError, ValueError):
+                raise ValueError(f"{param} must be of type {binding.type.__name__}")
+            if binding.minimum is not None and value < binding.minimum:
+                raise ValueError(f"{param} must be between {binding.minimum} and {binding.maximum}")
+            if binding.maximum is not None and value > binding.maximum:
+                raise ValueError(f"{param} must be between {binding.minimum} and {binding.maximum}")
+            params[param] = value
+        return params
+
+    def render(self, params):
+        """Return an isolated workflow for one request with the parameters applied"""
+        params = self.validate(params)
+        workflow = dict(self.workflow)
+        for node_id, targets in self._nodes.items():
+            inputs = dict(workflow[node_id]['inputs'])
+            for param, binding in targets:
+                value = params[param]
+                inputs[binding.input] = binding.transform(value) if binding.transform else value
+            workflow[node_id] = {**workflow[node_id], 'inputs': inputs}
+        return workflow
+
+FLUX_BINDINGS = {
+    # Positive and negative prompts (nodes 100 and 139)
+    'prompt': [InputBinding('100', 'text', str)],
+    'negative_prompt': [InputBinding('139', 'text', str)],
+    # Image dimensions and batch size (node 136)
+    'width': [InputBinding('136', 'width', int, 64, 2048)],
+    'height': [InputBinding('136', 'height', int, 64, 2048)],
+    'num_images': [InputBinding('136', 'batch_size', int, 1, MAX_IMAGES_PER_PROMPT)],
+    # Sampling parameters (node 137)
+    'seed': [InputBinding('137', 'seed', int, *SEED_RANGE)],
+    'steps': [InputBinding('137', 'steps', int, 1, 100)],
+    'cfg': [InputBinding('137', 'cfg', float, 0.1, 30)]
+}
+
+I2V_BINDINGS = {
+    # Positive and negative prompts (nodes 88 and 86)
+    'prompt': [InputBinding('88', 'text', str)],
+    'negative_prompt': [InputBinding('86', 'text', str)],
+    # Video dimensions and length (node 89)
+    'width': [InputBinding('89', 'width', int, 64, 2048)],
+    'height': [InputBinding('89', 'height', int, 64, 2048)],
+    'length': [InputBinding('89', 'length', int, 1, 1000)],
+    # Sampling parameters; the second pass (node 82) uses the next seed
+    'seed': [InputBinding('81', 'noise_seed', int, SEED_RANGE[0], SEED_RANGE[1] - 1),
+             InputBinding('82', 'noise_seed', int, SEED_RANGE[0], SEED_RANGE[1] - 1, lambda seed: seed + 1)],
+    'steps': [InputBinding('81', 'steps', int, 1, 100), InputBinding('82', 'steps', int, 1, 100)],
+    'cfg': [InputBinding('81', 'cfg', float, 0.1, 30), InputBinding('82', 'cfg', float, 0.1, 30)],
+    # Video output settings (node 62)
+    'frame_rate': [InputBinding('62', 'frame_rate', int, 1, 120)]
+}
+
+EDIT_BINDINGS = {
+    # Positive and negative prompts (nodes 76 and 77)
+    'prompt': [InputBinding('76', 'prompt', str)],
+    'negative_prompt': [InputBinding('77', 'prompt', str)],
+    # Sampling parameters (node 3)
+    'seed': [InputBinding('3', 'seed', int, *SEED_RANGE)],
+    'steps': [InputBinding('3', 'steps', int, 1, 100)],
+    'cfg': [InputBinding('3', 'cfg', float, 0.1, 30)]
+}
+
+# Workflow registry
+class WorkflowUnavailableError(RuntimeError):
+    """Raised when a registered workflow's template file is missing or invalid"""
+
+class WorkflowRegistry:
+    """Registered workflows, compiled from WORKFLOW_DIR on first use and recompiled when their file changes
+
+    A reload swaps in a new WorkflowTemplate; requests that already rendered a workflow keep
+    their own copy, so in-flight generations are not affected. If a changed file fails to load,
+    the previous version stays in use.
+    """
+
+    def __init__(self, directory=WORKFLOW_DIR, files=WORKFLOW_FILES, reload_interval=WORKFLOW_RELOAD_INTERVAL):
+        self.directory = directory
+        self.files = files
+        self.reload_interval = reload_interval
+        self._definitions = {}
+        self._entries = {}  # name -> {'template', 'mtime', 'checked_at', 'error'}
+        self._lock = threading.Lock()
+
+    def register(self, name, bindings, **info):
+        """Register a workflow by name; info (description, endpoint, ...) is listed by /workflows"""
+        if name not in self.files:
+            raise ValueError(f"No workflow file configured for {name}")
+        self._definitions[name] = (bindings, info)
+
+    def path(self, name):
+        return os.path.join(self.directory, self.files[name])
+
+    def get(self, name):
+        """Return the compiled template, loading or reloading it from disk when needed"""
+        with self._lock:
+            entry = self._entries.setdefault(name, {'template': None, 'mtime': None, 'checked_at': 0, 'error': None})
+            now = time.time()
+            if entry['template'] is not None and now - entry['checked_at'] < self.reload_interval:
+                return entry['template']
+            entry['checked_at'] = now
+            
+            try:
+                mtime = os.path.getmtime(self.path(name))
+                if mtime != entry['mtime']:
+                    bindings, _ = self._definitions[name]
+                    template = WorkflowTemplate(name, load_workflow_template(self.path(name)), bindings)
+                    if entry['template'] is not None:
+                        logger.info(f"Reloaded workflow {name} from {self.path(name)}")
+                    entry.update(template=template, mtime=mtime, error=None)
+            except (OSError, ValueError) as e:
+                entry['error'] = str(e)
+                if entry['template'] is None:
+                    raise WorkflowUnavailableError(f"Workflow {name} could not be loaded: {str(e)}")
+                logger.warning(f"Keeping previous version of workflow {name}: {str(e)}")
+            return entry['template']
+
+    def list(self):
+        """Describe every registered workflow and the state of its template file"""
+        workflows = []
+        for name, (bindings, info) in self._definitions.items():
+            entry = self._entries.get(name, {})
+            workflows.append({
+                'name': name,
+                **info,
+                'file': self.files[name],
+                'available': os.path.isfile(self.path(name)),
+                'loaded': entry.get('template') is not None,
+                'loaded_mtime': entry.get('mtime'),
+                'error': entry.get('error')
+            })
+        return workflows
+
+workflow_registry = WorkflowRegistry()
+workflow_registry.register(
+    'flux-krea-image-gen', FLUX_BINDINGS,
+    description='Generate images using Flux-KREA model',
+    endpoint='/generate-image',
+    method='POST',
+    parameters={
+        "prompt": "string (required)",
+        "negative_prompt": "string (optional)",
+        "width": "integer (64-2048, default: 1024)",
+        "height": "integer (64-2048, default: 1024)",
+        "steps": "integer (1-100, default: 20)",
+        "cfg": "float (0.1-30, default: 1)",
+        "seed": "integer (optional, random if not provided)",
+        "num_images": "integer (1-8, default: 1), variations from one batched sampler pass",
+        "seeds": "list of integers (optional), one image per seed; excludes num_images"
+    }
+)
+workflow_registry.register(
+    'qwen-image-edit', EDIT_BINDINGS,
+    description='Edit images using Qwen Image Edit model',
+    endpoint='/edit-image',
+    method='POST',
+    parameters={
+        "image": "file or base64 string (required)",
+        "prompt": "string (optional)",
+        "negative_prompt": "string (optional)",
+        "steps": "integer (1-100, default: 4)",
+        "cfg": "float (0.1-30, default: 1)",
+        "seed": "integer (optional, random if not provided)"
+    }
+)
+workflow_registry.register(
+    'wan-image-to-video', I2V_BINDINGS,
+    description='Generate video from image using WAN Image-To-Video model',
+    endpoint='/image-to-video',
+    method='POST',
+    parameters={
+        "image": "file or base64 string (required)",
+        "prompt": "string (required)",
+        "negative_prompt": "string (optional)",
+        "width": "integer (64-2048, default: 480)",
+        "height": "integer (64-2048, default: 832)",
+        "length": "integer (frames, 1-1000, default: 81)",
+        "steps": "integer (1-100, default: 6)",
+        "cfg": "float (0.1-30, default: 1)",
+        "seed": "integer (optional, random if not provided)",
+        "frame_rate": "integer (1-120, default: 32)"
+    }
+)
+
+# Result cache
+class ResultCache:
+    """Size-bounded LRU cache of workflow outputs on disk, keyed by a hash of the workflow and its inputs"""
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(workflow, images=None):
+        """Hash the final workflow, with uploaded image names replaced by their content hashes"""
+        workflow = dict(workflow)
+        for node_id, (image_data, _) in (images or {}).items():
+            node = workflow[node_id]
+            workflow[node_id] = {**node, 'inputs': {**node['inputs'], 'image': 'sha256:' + hashlib.sha256(image_data).hexdigest()}}
+        canonical = json.dumps(workflow, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return cached outputs ({node_id: [bytes]}) or None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                manifest = json.loads(f.readline())
+                outputs = {node_id: [f.read(size) for size in sizes] for node_id, sizes in manifest}
+            os.utime(path)
+            return outputs
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+            self._discard(key)
+            return None
+
+    def put(self, key, outputs):
+        """Store outputs under key and evict least recently used entries beyond max_bytes"""
+        manifest = [[node_id, [len(data) for data in items]] for node_id, items in outputs.items()]
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(manifest).encode('utf-8') + b'\n')
+            for items in outputs.values():
+                for data in items:
+                    f.write(data)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
             }
-        ]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.entry")
+
+    def _discard(self, key):
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _load_index(self):
+        """Rebuild the LRU order from entry modification times left by a previous run"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            elif name.endswith('.entry'):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-len('.entry')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+
+result_cache = ResultCache()
+
+# Singleflight coalescing of identical concurrent generations
+class GenerationFlight:
+    """One in-flight generation that identical requests attach to; the future resolves to its outputs"""
+
+    def __init__(self, key):
+        self.key = key
+        self.future = Future()
+        self.started_at = time.time()
+        self.followers = 0
+
+class InFlightGenerations:
+    """Runs identical concurrent workflows once, keyed like the result cache by workflow and input hashes"""
+
+    def __init__(self, enabled=SINGLEFLIGHT, max_age=EXECUTION_TIMEOUT):
+        self.enabled = enabled
+        self.max_age = max_age  # Flights whose leader never finished stop accepting followers after this
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, lead=True):
+        """Return (flight, leader); the leader runs the generation and must finish() the flight
+
+        With lead=False nothing is registered when no flight is running, and (None, False) is returned.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and time.time() - flight.started_at < self.max_age and not flight.future.done():
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+            if not lead:
+                return None, False
+            flight = self._flights[key] = GenerationFlight(key)
+            return flight, True
+
+    def finish(self, flight, outputs=None, error=None):
+        """Hand the leader's outputs or error to every follower"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if flight.future.done():
+            return
+        if error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(outputs)
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'in_flight': len(self._flights), 'coalesced': self.coalesced}
+
+generation_flights = InFlightGenerations()
+
+class ProgressReporter:
+    """Turns one prompt's ComfyUI websocket events into job progress events"""
+
+    def __init__(self, progress, backend, waiter):
+        self.progress = progress
+        self.backend = backend
+        self.waiter = waiter
+        self.started = False
+        self.position = None
+        self.current_node = None
+        self.last_preview = 0
+
+    def report_queue_position(self):
+        """Publish how many prompts are ahead of this one in the backend's queue"""
+        try:
+            positions = self.backend.client.get_queue_positions()
+        except Exception as e:
+            logger.debug(f"Could not read queue position: {str(e)}")
+            return
+        
+        position = positions.get(self.waiter.prompt_id)
+        if position is None:
+            return  # Already running, or finished before we looked
+        if position != self.position:
+            self.position = position
+            self.progress.publish('queue', {
+                'prompt_id': self.waiter.prompt_id,
+                'backend': self.backend.address,
+                'position': position
+            })
+
+    def report_preview(self, frame):
+        """Publish a sampler preview frame as a small JPEG, at most PREVIEW_MAX_FPS times a second"""
+        now = time.time()
+        if now - self.last_preview < 1 / PREVIEW_MAX_FPS:
+            return
+        
+        # Frames start with an event type (1 = preview image) and an image format, 4 bytes each
+        if len(frame) < 8 or struct.unpack('>I', frame[:4])[0] != 1:
+            return
+        try:
+            with Image.open(io.BytesIO(frame[8:])) as image:
+                image.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE))
+                buffer = io.BytesIO()
+                image.convert('RGB').save(buffer, 'JPEG', quality=PREVIEW_JPEG_QUALITY)
+        except Exception as e:
+            logger.debug(f"Could not decode preview frame: {str(e)}")
+            return
+        
+        self.last_preview = now
+        self.progress.publish_preview(buffer.getvalue(), {
+            'prompt_id': self.waiter.prompt_id,
+            'node': self.current_node
+        })
+
+    def __call__(self, event):
+        if isinstance(event, bytes):
+            # SaveImageWebsocket outputs arrive as binary frames too; only sampler previews are forwarded
+            if self.progress.previews and self.current_node not in self.waiter.websocket_nodes:
+                self.report_preview(event)
+            return
+        data = event.get('data') or {}
+        if event['type'] == 'status':
+            if not self.started:
+                self.report_queue_position()
+        elif event['type'] == 'execution_start':
+            self.started = True
+            self.progress.publish('queue', {
+                'prompt_id': self.waiter.prompt_id,
+                'backend': self.backend.address,
+                'position': 0
+            })
+        elif event['type'] == 'executing' and data.get('node') is not None:
+            self.started = True
+            self.current_node = data['node']
+            node = self.waiter.workflow.get(data['node'], {})
+            self.progress.publish('node', {
+                'prompt_id': self.waiter.prompt_id,
+                'node': data['node'],
+                'class_type': node.get('class_type'),
+                'title': node.get('_meta', {}).get('title')
+            })
+        elif event['type'] == 'progress':
+            self.progress.publish('progress', {
+                'prompt_id': self.waiter.prompt_id,
+                'node': data.get('node'),
+                'value': data.get('value'),
+                'max': data.get('max'),
+                'percent': round(100 * data['value'] / data['max'], 1) if data.get('max') else None
+            })
+
+# Node profiling
+class NodeProfiler:
+    """Times each node of one prompt from the order of ComfyUI's 'executing' events
+
+    ComfyUI announces every node as it starts, so a node's duration is the time until the next
+    announcement. Nodes whose outputs ComfyUI reused are listed in 'execution_cached' and never run.
+    """
+
+    def __init__(self, workflow):
+        self.workflow = workflow
+        self.nodes = []
+        self.cached_nodes = []
+        self._current = None
+        self._current_started = None
+
+    def __call__(self, event):
+        if not isinstance(event, dict):
+            return
+        data = event.get('data') or {}
+        if event['type'] == 'execution_cached':
+            self.cached_nodes.extend(self._describe(node_id) for node_id in data.get('nodes', []))
+        elif event['type'] == 'executing':
+            now = time.perf_counter()
+            if self._current is not None:
+                self.nodes.append({**self._describe(self._current), 'seconds': round(now - self._current_started, 4)})
+            self._current = data.get('node')
+            self._current_started = now
+
+    def _describe(self, node_id):
+        node = self.workflow.get(node_id, {})
+        return {'node': node_id, 'class_type': node.get('class_type'), 'title': node.get('_meta', {}).get('title')}
+
+def is_loader_node(class_type):
+    """Loader nodes (UnetLoaderGGUF, VAELoader, DualCLIPLoader, ...) only execute when their model is not cached"""
+    return bool(class_type) and 'Loader' in class_type
+
+class NodeProfileStats:
+    """Per-workflow aggregate of node timings, showing which nodes dominate and when models get reloaded"""
+
+    def __init__(self):
+        self._workflows = {}
+        self._warm = set()  # (workflow, backend) pairs that already loaded their models once
+        self._lock = threading.Lock()
+
+    def record(self, workflow_name, backend_address, profile):
+        """Add one finished prompt's profile"""
+        with self._lock:
+            stats = self._workflows.setdefault(workflow_name, {
+                'runs': 0, 'total_seconds': 0.0, 'nodes': {},
+                'model_loads': {'executed': 0, 'cached': 0, 'reloads': 0, 'reloads_by_backend': {}}
+            })
+            stats['runs'] += 1
+            stats['total_seconds'] += profile['execution_seconds']
+            
+            loaded = False
+            for entry in profile['nodes']:
+                node = stats['nodes'].setdefault(entry['node'], {
+                    'node': entry['node'], 'class_type': entry['class_type'], 'title': entry['title'],
+                    'count': 0, 'cached': 0, 'total_seconds': 0.0, 'max_seconds': 0.0
+                })
+                node['count'] += 1
+                node['total_seconds'] += entry['seconds']
+                node['max_seconds'] = max(node['max_seconds'], entry['seconds'])
+                if is_loader_node(entry['class_type']):
+                    stats['model_loads']['executed'] += 1
+                    loaded = True
+            for entry in profile['cached_nodes']:
+                node = stats['nodes'].setdefault(entry['node'], {
+                    **entry, 'count': 0, 'cached': 0, 'total_seconds': 0.0, 'max_seconds': 0.0
+                })
+                node['cached'] += 1
+                if is_loader_node(entry['class_type']):
+                    stats['model_loads']['cached'] += 1
+            
+            # A loader running again on a backend that already ran this workflow means its model was evicted
+            key = (workflow_name, backend_address)
+            if loaded and key in self._warm:
+                loads = stats['model_loads']
+                loads['reloads'] += 1
+                loads['reloads_by_backend'][backend_address] = loads['reloads_by_backend'].get(backend_address, 0) + 1
+                logger.info(f"Workflow {workflow_name} reloaded models on {backend_address}")
+            self._warm.add(key)
+
+    def to_dict(self):
+        """Summarize every workflow with its nodes sorted by total time"""
+        with self._lock:
+            workflows = {}
+            for name, stats in self._workflows.items():
+                nodes = []
+                for node in stats['nodes'].values():
+                    nodes.append({
+                        **node,
+                        'total_seconds': round(node['total_seconds'], 4),
+                        'max_seconds': round(node['max_seconds'], 4),
+                        'mean_seconds': round(node['total_seconds'] / node['count'], 4) if node['count'] else None,
+                        'share': round(node['total_seconds'] / stats['total_seconds'], 4) if stats['total_seconds'] else None
+                    })
+                nodes.sort(key=lambda node: node['total_seconds'], reverse=True)
+                workflows[name] = {
+                    'runs': stats['runs'],
+                    'mean_execution_seconds': round(stats['total_seconds'] / stats['runs'], 4),
+                    'nodes': nodes,
+                    'model_loads': stats['model_loads']
+                }
+            return workflows
+
+node_profiles = NodeProfileStats()
+
+class PendingGeneration:
+    """A generation that was queued on a backend, or answered from the result cache"""
+
+    def __init__(self, backend=None, waiter=None, cache_key=None, outputs=None, progress=None, workflow_name='unknown',
+                 profiles=None, flight=None):
+        self.backend = backend
+        self.waiter = waiter
+        self.cache_key = cache_key
+        self.outputs = outputs
+        self.progress = progress
+        self.workflow_name = workflow_name
+        self.profile = None
+        self.profiles = profiles  # The request's list of profiles, when it asked for them
+        self.flight = flight  # Led by this generation when waiter is set, otherwise followed
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+        self.executed_at = None
+
+    def wait(self, on_event=None):
+        """Block until the outputs ({node_id: [bytes]}) are available"""
+        if self.outputs is not None:
+            return self.outputs
+        if self.waiter is None:
+            return self.flight.future.result(EXECUTION_TIMEOUT)
+        try:
+            return self._land(self._wait(on_event))
+        except Exception as e:
+            self._land(error=e)
+            raise
+        finally:
+            if self.profile is not None and self.profiles is not None:
+                self.profiles.append(self.profile)
+
+    async def wait_async(self, on_event=None):
+        """Await the outputs of a generation started with start_generation_async"""
+        if self.outputs is not None:
+            return self.outputs
+        if self.waiter is None:
+            return await asyncio.wait_for(asyncio.wrap_future(self.flight.future), EXECUTION_TIMEOUT)
+        try:
+            on_event, profiler = self._event_handler(on_event)
+            loop = asyncio.get_running_loop()
+            error = None
+            try:
+                if on_event.reporter is not None:
+                    await loop.run_in_executor(async_io_pool, on_event.reporter.report_queue_position)
+                self.outputs = await self.backend.async_client.finish_workflow(self.waiter, on_event)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                backend_pool.release(self.backend, error)
+            self._finished(profiler)
+            return self._land(self.outputs)
+        except Exception as e:
+            self._land(error=e)
+            raise
+        finally:
+            if self.profile is not None and self.profiles is not None:
+                self.profiles.append(self.profile)
+
+    def _wait(self, on_event):
+        on_event, profiler = self._event_handler(on_event)
+        if on_event.reporter is not None:
+            on_event.reporter.report_queue_position()
+        
+        error = None
+        try:
+            self.outputs = self.backend.client.finish_workflow(self.waiter, on_event)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            backend_pool.release(self.backend, error)
+        self._finished(profiler)
+        return self.outputs
+
+    def cancel(self):
+        """Remove this generation's prompt from its backend, unless other requests are following it"""
+        if self.waiter is None or self.outputs is not None:
+            return
+        if self.flight is not None and self.flight.followers:
+            logger.info(f"Leaving prompt {self.waiter.prompt_id} running for {self.flight.followers} coalesced request(s)")
+            return
+        self.backend.client.cancel_prompt(self.waiter)
+
+    def _land(self, outputs=None, error=None):
+        """Pass the outcome to requests that attached to this generation"""
+        if self.flight is not None:
+            generation_flights.finish(self.flight, outputs, error)
+        return outputs
+
+    def _finished(self, profiler):
+        """Record timings and hand the outputs to the result cache without waiting for the disk write"""
+        self.record_timings(profiler)
+        if self.cache_key is not None:
+            async_io_pool.submit(store_result, self.cache_key, self.outputs)
+
+    def _event_handler(self, on_event):
+        """Wrap on_event with progress reporting, stage timing and node profiling"""
+        # Forward queue position, current node and step progress to the job's event stream
+        reporter = None
+        if self.progress is not None:
+            reporter = ProgressReporter(self.progress, self.backend, self.waiter)
+            if on_event is None:
+                on_event = reporter
+            else:
+                callback = on_event
+                def on_event(event):
+                    reporter(event)
+                    callback(event)
+        
+        # Split the wait into time queued in ComfyUI, execution and output download, and time every node
+        profiler = NodeProfiler(self.waiter.workflow)
+        callback = on_event
+        def on_event(event):
+            profiler(event)
+            if isinstance(event, dict):
+                if event['type'] == 'execution_start':
+                    self.started_at = time.perf_counter()
+                elif event['type'] == 'executing' and (event.get('data') or {}).get('node') is None:
+                    self.executed_at = time.perf_counter()
+            if callback is not None:
+                callback(event)
+        on_event.reporter = reporter
+        return on_event, profiler
+
+    def record_timings(self, profiler):
+        """Observe the queue wait, execution and download stages and the node profile of a finished prompt"""
+        if self.started_at is None or self.executed_at is None:
+            return  # Events were missed, e.g. the websocket reconnected mid-run
+        finished_at = time.perf_counter()
+        self.profile = {
+            'prompt_id': self.waiter.prompt_id,
+            'backend': self.backend.address,
+            'queue_wait_seconds': round(self.started_at - self.queued_at, 4),
+            'execution_seconds': round(self.executed_at - self.started_at, 4),
+            'download_seconds': round(finished_at - self.executed_at, 4),
+            'nodes': profiler.nodes,
+            'cached_nodes': profiler.cached_nodes
+        }
+        node_profiles.record(self.workflow_name, self.backend.address, self.profile)
+        metrics.observe('illustrify_stage_duration_seconds', self.started_at - self.queued_at,
+                        stage='queue_wait', workflow=self.workflow_name)
+        metrics.observe('illustrify_stage_duration_seconds', self.executed_at - self.started_at,
+                        stage='execution', workflow=self.workflow_name)
+        metrics.observe('illustrify_stage_duration_seconds', finished_at - self.executed_at,
+                        stage='download', workflow=self.workflow_name)
+
+def lookup_result_cache(workflow, options, images):
+    """Return (cache_key, PendingGeneration holding the cached outputs or None)"""
+    if not (options['cache'] and result_cache.enabled):
+        return None, None
+    cache_key = result_cache.key(workflow, images)
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return cache_key, None
+    logger.info(f"Result cache hit {cache_key[:12]}")
+    if options.get('progress') is not None:
+        options['progress'].publish('cache_hit', {'key': cache_key})
+    return cache_key, PendingGeneration(outputs=cached)
+
+def store_result(cache_key, outputs):
+    """Write a generation's outputs to the result cache; runs on async_io_pool, off the request path"""
+    try:
+        result_cache.put(cache_key, outputs)
+    except OSError as e:
+        logger.warning(f"Could not write result cache entry: {str(e)}")
+
+def join_flight(workflow, options, images, cache_key, lead=True):
+    """Attach to an identical in-flight generation: returns (flight to lead, None) or (None, PendingGeneration following one)"""
+    if not generation_flights.enabled:
+        return None, None
+    flight, leader = generation_flights.join(cache_key or ResultCache.key(workflow, images), lead)
+    if leader or flight is None:
+        return flight, None
+    logger.info(f"Coalesced request with in-flight generation {flight.key[:12]}")
+    metrics.inc('illustrify_coalesced_requests_total', workflow=options.get('workflow', 'unknown'))
+    if options.get('progress') is not None:
+        options['progress'].publish('coalesced', {'key': flight.key})
+    return None, PendingGeneration(progress=options.get('progress'), workflow_name=options.get('workflow', 'unknown'),
+                                   flight=flight)
+
+def retry_uploads(backend, images, error, attempt):
+    """Decide whether a rejected /prompt should be retried with freshly uploaded input images
+
+    ComfyUI rejects a LoadImage node whose file is missing with a value_not_in_list node error,
+    which happens when the upload registry still lists a file the server has lost (a restart or
+    a cleaned input folder). Any other rejection is returned as it is.
+    """
+    if error.status_code != 400 or not images or attempt:
+        return False
+    node_errors = error.details.get('node_errors') if isinstance(error.details, dict) else None
+    if not isinstance(node_errors, dict):
+        return False
+    missing = [node_id for node_id in images
+               if any(node_error.get('type') == 'value_not_in_list'
+                      for node_error in (node_errors.get(node_id) or {}).get('errors', []))]
+    if not missing:
+        return False
+    logger.warning(f"ComfyUI backend {backend.address} is missing the input images of nodes {missing}, uploading them again")
+    for node_id in missing:
+        backend.client.forget_upload(images[node_id][0])
+    return True
+
+def track_generation(generation, options):
+    """Register a queued generation with the request's job, so DELETE /jobs/<id> can reach its prompt"""
+    job = options.get('job')
+    if job is not None:
+        job.generations.append(generation)
+        if job.cancelled:
+            job_manager.cancel_generation(job, generation)  # Cancelled while the prompt was being queued
+    return generation
+
+def start_generation(workflow, options, images=None):
+    """Upload input images and queue the workflow, serving seeded runs from the result cache
+
+    images maps a LoadImage node id to (image_data, filename).
+    """
+    images = images or {}
+    ticket = options.get('ticket')
+    if ticket is not None and ticket.cancelled:
+        raise GenerationCancelled()
+    cache_key, cached = lookup_result_cache(workflow, options, images)
+    if cached is not None:
+        return cached
+    defer = options.get('defer_admission') and ticket is not None and not ticket.admitted.is_set()
+    flight, followed = join_flight(workflow, options, images, cache_key, lead=not defer)
+    if followed is not None:
+        return followed
+    if defer:
+        raise AdmissionDeferred(options['tickets'])
+    
+    try:
+        # Wait for the scheduler to admit this request before it reaches ComfyUI
+        if options.get('ticket') is not None:
+            scheduler.acquire(options['ticket'])
+        
+        # A backend that cannot be reached is skipped in favour of the next one until none are left
+        unreachable = []
+        while True:
+            backend = backend_pool.select(options.get('models'), exclude=unreachable)
+            try:
+                for attempt in range(2):
+                    # Upload images to the same ComfyUI server that runs the workflow
+                    for node_id, (image_data, filename) in images.items():
+                        with metrics.time('upload', options.get('workflow', 'unknown')):
+                            upload_result = backend.client.upload_image(image_data, filename)
+                        set_node_input(workflow, node_id, 'image', upload_result['name'])
+                    
+                    try:
+                        waiter = backend.client.start_workflow(workflow, retrieval=options['retrieval'])
+                        break
+                    except ComfyUIExecutionError as e:
+                        if not retry_uploads(backend, images, e, attempt):
+                            raise
+                break
+            except ConnectionError as e:
+                backend_pool.release(backend, e)
+                unreachable.append(backend)
+                logger.warning(f"Could not queue on ComfyUI backend {backend.address}, trying another one: {str(e)}")
+            except Exception as e:
+                backend_pool.release(backend, e)
+                raise
+    except Exception as e:
+        if flight is not None:
+            generation_flights.finish(flight, error=e)
+        raise
+    return track_generation(PendingGeneration(backend, waiter, cache_key, progress=options.get('progress'),
+                                              workflow_name=options.get('workflow', 'unknown'),
+                                              profiles=options.get('profiles'), flight=flight), options)
+
+def execute_generation(workflow, options, images=None):
+    """Upload input images, execute the workflow and return its outputs"""
+    return start_generation(workflow, options, images).wait()
+
+async def start_generation_async(workflow, options, images=None):
+    """start_generation for coroutines: waits for the scheduler and ComfyUI without holding a thread"""
+    images = images or {}
+    loop = asyncio.get_running_loop()
+    cache_key, cached = await loop.run_in_executor(async_io_pool, lookup_result_cache, workflow, options, images)
+    if cached is not None:
+        return cached
+    flight, followed = join_flight(workflow, options, images, cache_key)
+    if followed is not None:
+        return followed
+    
+    try:
+        if options.get('ticket') is not None:
+            await scheduler.acquire_async(options['ticket'])
+        
+        unreachable = []
+        while True:
+            backend = backend_pool.select(options.get('models'), exclude=unreachable)
+            try:
+                for attempt in range(2):
+                    for node_id, (image_data, filename) in images.items():
+                        with metrics.time('upload', options.get('workflow', 'unknown')):
+                            upload_result = await backend.async_client.upload_image(image_data, filename)
+                        set_node_input(workflow, node_id, 'image', upload_result['name'])
+                    
+                    try:
+                        waiter = await backend.async_client.start_workflow(workflow, retrieval=options['retrieval'])
+                        break
+                    except ComfyUIExecutionError as e:
+                        if not retry_uploads(backend, images, e, attempt):
+                            raise
+                break
+            except ConnectionError as e:
+                backend_pool.release(backend, e)
+                unreachable.append(backend)
+                logger.warning(f"Could not queue on ComfyUI backend {backend.address}, trying another one: {str(e)}")
+            except Exception as e:
+                backend_pool.release(backend, e)
+                raise
+    except Exception as e:
+        if flight is not None:
+            generation_flights.finish(flight, error=e)
+        raise
+    generation = PendingGeneration(backend, waiter, cache_key, progress=options.get('progress'),
+                                   workflow_name=options.get('workflow', 'unknown'), profiles=options.get('profiles'),
+                                   flight=flight)
+    return await loop.run_in_executor(async_io_pool, track_generation, generation, options)
+
+async def execute_generation_async(workflow, options, images=None):
+    """Upload input images, execute the workflow and return its outputs, as a coroutine"""
+    generation = await start_generation_async(workflow, options, images)
+    return await generation.wait_async()
+
+# Generation results
+class OutputFile:
+    """One generated file, kept as raw bytes until the response is rendered"""
+
+    MIMETYPES = {
+        'png': 'image/png',
+        'jpeg': 'image/jpeg',
+        'webp': 'image/webp',
+        'avif': 'image/avif',
+        'gif': 'image/gif',
+        'mp4': 'video/mp4',
+        'webm': 'video/webm'
+    }
+
+    def __init__(self, data, format, node_id, metadata=None):
+        self.data = data
+        self.format = format
+        self.node_id = node_id
+        self.metadata = metadata or {}  # Extra per-file fields such as seed and batch_index
+
+    @property
+    def mimetype(self):
+        return self.MIMETYPES.get(self.format, 'application/octet-stream')
+
+class GenerationResult:
+    """Outputs and parameters of a finished generation, grouped by response key"""
+
+    def __init__(self, parameters, groups):
+        # groups maps a response key ('images', 'videos', 'frames') to the field holding each file's data
+        self.parameters = parameters
+        self.fields = dict(groups)
+        self.groups = {group: [] for group in groups}
+        self.profile = None  # Per-prompt node timings, when the request asked for them
+        self.postprocessed = False  # Batch prompts are post-processed as they finish, before the batch is
+
+    def add(self, group, output):
+        self.groups[group].append(output)
+
+    def outputs(self, include=None):
+        """Return (group, OutputFile) pairs in response order, optionally limited to some groups"""
+        return [(group, output) for group, outputs in self.groups.items()
+                if include is None or group in include
+                for output in outputs]
+
+    def to_dict(self):
+        """Build the JSON response body with base64-encoded outputs"""
+        body = {'success': True}
+        for group, outputs in self.groups.items():
+            body[group] = [{
+                self.fields[group]: base64.b64encode(output.data).decode('utf-8'),
+                'format': output.format,
+                **output.metadata
+            } for output in outputs]
+        body['parameters'] = self.parameters
+        if self.profile is not None:
+            body['profile'] = self.profile
+        return body
+
+# Output post-processing: metadata stripping, transcoding and thumbnails
+transcode_pool = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix='comfy-transcode')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_TEXT_CHUNKS = (b'tEXt', b'zTXt', b'iTXt')
+
+def output_format_available(output_format):
+    """Check whether Pillow can encode the given output format"""
+    Image.init()
+    return output_format.upper() in Image.SAVE
+
+def strip_png_text(image_data):
+    """Drop the text chunks (ComfyUI's embedded prompt and workflow JSON) from a PNG without decoding it"""
+    if not image_data.startswith(PNG_SIGNATURE):
+        return image_data
+    chunks = [PNG_SIGNATURE]
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(image_data):
+        length, chunk_type = struct.unpack('>I4s', image_data[position:position + 8])
+        end = position + 12 + length  # Length and type, data, CRC
+        if chunk_type not in PNG_TEXT_CHUNKS:
+            chunks.append(image_data[position:end])
+        position = end
+        if chunk_type == b'IEND':
+            break
+    return b''.join(chunks)
+
+def parse_thumbnail_size(spec):
+    """Parse a PocketBase-style thumb size: WxH (center crop), WxHt / WxHb (top / bottom crop), WxHf (fit), Wx0 / 0xH"""
+    match = re.fullmatch(r'(\d+)x(\d+)([tbf]?)', str(spec).strip())
+    if not match:
+        raise ValueError(f"Invalid thumbnail size {spec!r}; use WxH, WxHt, WxHb, WxHf, Wx0 or 0xH")
+    width, height, mode = int(match.group(1)), int(match.group(2)), match.group(3)
+    if not (width or height) or width > THUMBNAIL_MAX_SIZE or height > THUMBNAIL_MAX_SIZE:
+        raise ValueError(f"Thumbnail sizes must be between 1 and {THUMBNAIL_MAX_SIZE} pixels")
+    return match.group(0), width, height, mode
+
+def make_thumbnail(image, size):
+    """Resize an already decoded image to a parsed thumbnail size"""
+    _, width, height, mode = size
+    if not (width and height):
+        # One side given: keep the aspect ratio
+        scale = (width / image.width) if width else (height / image.height)
+        return image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    if mode == 'f':
+        return ImageOps.contain(image, (width, height), Image.LANCZOS)
+    centering = {'t': (0.5, 0.0), 'b': (0.5, 1.0)}.get(mode, (0.5, 0.5))
+    return ImageOps.fit(image, (width, height), Image.LANCZOS, centering=centering)
+
+def encode_image(image, output_format, quality):
+    """Encode a decoded image in output_format"""
+    buffer = io.BytesIO()
+    if output_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, output_format.upper(), quality=quality)
+    return buffer.getvalue()
+
+def postprocess_image(image_data, output_format, quality, thumbnail_sizes=()):
+    """Strip metadata, transcode and cut thumbnails from one image, decoding it at most once
+
+    Returns (image bytes, [(size, thumbnail bytes, (width, height))]).
+    """
+    transcode = output_format != 'png'
+    if not transcode and not thumbnail_sizes:
+        return (strip_png_text(image_data) if STRIP_OUTPUT_METADATA else image_data), []
+    
+    with Image.open(io.BytesIO(image_data)) as image:
+        image.load()
+        if transcode:
+            # Pillow does not copy PNG text chunks into other formats
+            image_data = encode_image(image, output_format, quality)
+        elif STRIP_OUTPUT_METADATA:
+            image_data = strip_png_text(image_data)
+        thumbnails = []
+        for size in thumbnail_sizes:
+            thumbnail = make_thumbnail(image, size)
+            thumbnails.append((size[0], encode_image(thumbnail, output_format, quality), thumbnail.size))
+    return image_data, thumbnails
+
+def postprocess_targets(result, options):
+    """Return the GenerationResults of a result or batch and the image outputs in each that need post-processing"""
+    if not (STRIP_OUTPUT_METADATA or options.get('output_format', 'png') != 'png' or options.get('thumbnails')):
+        return []
+    results = result.items if isinstance(result, BatchResult) else [result]
+    return [(item, group, index, output) for item in results
+            if isinstance(item, GenerationResult) and not item.postprocessed
+            for group, outputs in list(item.groups.items()) if item.fields[group] == 'image'
+            for index, output in enumerate(outputs)]
+
+def apply_postprocessed(targets, processed, options):
+    """Store post-processed image bytes on their outputs and add the thumbnails group"""
+    for (item, group, index, output), (image_data, thumbnails) in zip(targets, processed):
+        item.postprocessed = True
+        output.data = image_data
+        output.format = options['output_format']
+        if thumbnails and 'thumbnails' not in item.groups:
+            item.fields['thumbnails'] = 'image'
+            item.groups['thumbnails'] = []
+        for size, thumbnail_data, (width, height) in thumbnails:
+            item.add('thumbnails', OutputFile(thumbnail_data, options['output_format'], output.node_id, {
+                **output.metadata, 'size': size, 'width': width, 'height': height,
+                'source_group': group, 'source_index': index}))
+
+def postprocess_result(result, options):
+    """Post-process a result's image outputs on the transcode pool, in place"""
+    targets = postprocess_targets(result, options)
+    if targets:
+        process = partial(postprocess_image, output_format=options['output_format'], quality=options['quality'],
+                          thumbnail_sizes=options['thumbnails'])
+        with metrics.time('postprocess', options['workflow']):
+            apply_postprocessed(targets, list(transcode_pool.map(process, [target[3].data for target in targets])), options)
+    return result
+
+async def postprocess_result_async(result, options):
+    """postprocess_result for coroutines"""
+    targets = postprocess_targets(result, options)
+    if targets:
+        loop = asyncio.get_running_loop()
+        with metrics.time('postprocess', options['workflow']):
+            processed = await asyncio.gather(*(
+                loop.run_in_executor(transcode_pool, postprocess_image, target[3].data,
+                                     options['output_format'], options['quality'], options['thumbnails'])
+                for target in targets))
+            apply_postprocessed(targets, processed, options)
+    return result
+
+RESPONSE_MODES = ('json', 'binary')
+STREAM_CHUNK_SIZE = 256 * 1024
+
+def response_options(data):
+    """Read response_mode and include from the request body or query string"""
+    data = data or {}
+    mode = request.args.get('response_mode') or data.get('response_mode') or 'json'
+    if mode not in RESPONSE_MODES:
+        raise ValueError(f"response_mode must be one of: {', '.join(RESPONSE_MODES)}")
+    include = request.args.get('include') or data.get('include')
+    if isinstance(include, str):
+        include = [group.strip() for group in include.split(',') if group.strip()]
+    return mode, include
+
+def render_result(result, data):
+    """Render a GenerationResult as JSON, a raw file body, or a multipart/mixed stream"""
+    mode, include = response_options(data)
+    if mode == 'json':
+        return jsonify(result.to_dict())
+    if not isinstance(result, GenerationResult):
+        raise ValueError('This result is only available as JSON')
+    
+    outputs = result.outputs(include)
+    if not outputs:
+        raise ValueError('The generation produced no outputs to return')
+    
+    headers = {
+        'X-Generation-Parameters': json.dumps(result.parameters),
+        'X-Output-Count': str(len(outputs))
+    }
+    
+    # A single output is sent as the body itself
+    if len(outputs) == 1:
+        group, output = outputs[0]
+        headers.update({
+            'X-Output-Group': group,
+            'X-Output-Format': output.format,
+            'X-Node-Id': output.node_id,
+            'Content-Length': str(len(output.data))
+        })
+        if output.metadata:
+            headers['X-Output-Metadata'] = json.dumps(output.metadata)
+        return Response(output.data, mimetype=output.mimetype, headers=headers)
+    
+    # Several outputs are streamed as multipart/mixed parts without building the body in memory
+    boundary = uuid.uuid4().hex
+    parts = []
+    for index, (group, output) in enumerate(outputs):
+        metadata_header = f"X-Output-Metadata: {json.dumps(output.metadata)}\r\n" if output.metadata else ''
+        part_headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {output.mimetype}\r\n"
+            f"Content-Length: {len(output.data)}\r\n"
+            f"Content-Disposition: attachment; filename=\"{group}_{index}.{output.format}\"\r\n"
+            f"X-Output-Group: {group}\r\n"
+            f"X-Node-Id: {output.node_id}\r\n"
+            f"{metadata_header}\r\n"
+        ).encode('utf-8')
+        parts.append((part_headers, output.data))
+    closing = f"--{boundary}--\r\n".encode('utf-8')
+    headers['Content-Length'] = str(
+        sum(len(part_headers) + len(data) + 2 for part_headers, data in parts) + len(closing)
+    )
+    
+    def generate():
+        for part_headers, data in parts:
+            yield part_headers
+            # WSGI servers only accept bytes, so chunks are slices rather than memoryviews
+            for start in range(0, len(data), STREAM_CHUNK_SIZE):
+                yield data[start:start + STREAM_CHUNK_SIZE]
+            yield b'\r\n'
+        yield closing
+    
+    return Response(generate(), mimetype=f'multipart/mixed; boundary={boundary}', headers=headers)
+
+# Asynchronous job API
+class ProgressStream:
+    """Ordered, replayable progress events of a job, followed by SSE clients"""
+
+    def __init__(self, max_events=JOB_EVENT_HISTORY, previews=False):
+        self.max_events = max_events
+        self.previews = previews
+        self.latest_preview = None  # JPEG bytes of the newest preview frame
+        self.closed = False
+        self._events = []  # (event_id, event_type, data)
+        self._next_id = 1
+        self._condition = threading.Condition()
+
+    def publish(self, event_type, data):
+        """Append an event and wake up every follower"""
+        with self._condition:
+            if self.closed:
+                return
+            self._events.append((self._next_id, event_type, data))
+            self._next_id += 1
+            if len(self._events) > self.max_events:
+                del self._events[:len(self._events) - self.max_events]
+            self._condition.notify_all()
+
+    def publish_preview(self, jpeg, data):
+        """Publish a preview frame, replacing older frames that followers have not read yet"""
+        with self._condition:
+            if self.closed:
+                return
+            self.latest_preview = jpeg
+            self._events = [event for event in self._events if event[1] != 'preview']
+        self.publish('preview', {**data, 'image': base64.b64encode(jpeg).decode('utf-8'), 'format': 'jpeg'})
+
+    def close(self):
+        """Mark the stream finished; followers return after the last event"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def follow(self, after=0, keepalive=SSE_KEEPALIVE_INTERVAL):
+        """Yield events with an id above after, and None whenever keepalive seconds pass quietly"""
+        while True:
+            with self._condition:
+                pending = [event for event in self._events if event[0] > after]
+                if not pending and not self.closed:
+                    self._condition.wait(keepalive)
+                    pending = [event for event in self._events if event[0] > after]
+                closed = self.closed
+            if not pending and closed:
+                return
+            if not pending:
+                yield None
+            for event in pending:
+                after = event[0]
+                yield event
+
+class Job:
+    """A generation submitted through the submit/poll job API"""
+
+    def __init__(self, workflow_name, progress=None, idempotency_key=None):
+        self.id = str(uuid.uuid4())
+        self.workflow_name = workflow_name
+        self.idempotency_key = idempotency_key  # (client_id, Idempotency-Key header) when one was sent
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.error_type = None
+        self.exception = None
+        self.done = threading.Event()
+        self.cancelled = False
+        self.tickets = ()  # Scheduler tickets, withdrawn when the job is cancelled while they wait
+        self.generations = []  # PendingGenerations queued on a backend, whose prompts a cancel removes
+        self.progress = progress or ProgressStream()
+        self.progress.publish('status', {'status': self.status})
+
+    def to_dict(self, include_result=True):
+        """Serialize the job for GET /jobs/<id>"""
+        job = {
+            'job_id': self.id,
+            'workflow': self.workflow_name,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == 'completed' and include_result:
+            job['result'] = self.result.to_dict()
+        elif self.status in ('failed', 'cancelled'):
+            job['error'] = self.error
+            job['error_type'] = self.error_type
+        return job
+
+class JobManager:
+    """Runs submitted generations on a worker pool and keeps their results for polling
+
+    Coroutine jobs (submit_async) run on one background event loop instead, so a job waiting on
+    the scheduler or ComfyUI costs a task rather than a worker thread.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL):
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='comfy-job')
+        self._jobs = {}
+        self._idempotent = {}  # (client_id, Idempotency-Key) -> job id
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def submit(self, workflow_name, fn, *args, progress=None, job=None, tickets=None):
+        """Queue fn(*args) as a job and return it immediately; fn returns a GenerationResult
+
+        With scheduler tickets the job only takes a worker thread once its first ticket is
+        admitted, so clients waiting for a slot cannot tie up the pool.
+        """
+        job = job or self.create(workflow_name, progress)
+        if not tickets:
+            self._executor.submit(self._run, job, fn, args)
+        else:
+            self._park(job, tickets, fn, args)
+        logger.info(f"Submitted {workflow_name} job {job.id}")
+        return job
+
+    def submit_async(self, workflow_name, coroutine_fn, *args, progress=None, job=None):
+        """Schedule coroutine_fn(*args) on the job event loop and return the job immediately"""
+        job = job or self.create(workflow_name, progress)
+        self.run_coroutine(self._run_async(job, coroutine_fn, args))
+        logger.info(f"Submitted {workflow_name} async job {job.id}")
+        return job
+
+    def run(self, job, fn, *args):
+        """Run fn(*args) as the given job in the calling thread"""
+        self._run(job, fn, args)
+        return job
+
+    def claim(self, workflow_name, idempotency_key, progress=None):
+        """Return (job, created): the job already registered under idempotency_key, or a new queued one"""
+        with self._lock:
+            self._evict_expired()
+            job = self._jobs.get(self._idempotent.get(idempotency_key))
+            if job is not None:
+                return job, False
+            job = Job(workflow_name, progress, idempotency_key)
+            self._jobs[job.id] = job
+            self._idempotent[idempotency_key] = job.id
+            return job, True
+
+    def discard(self, job):
+        """Forget a claimed job that never ran, so its Idempotency-Key can be retried"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        self._forget_key(job)
+
+    def _forget_key(self, job):
+        # Later requests with the job's Idempotency-Key start a new job instead of getting this one
+        with self._lock:
+            if job.idempotency_key is not None and self._idempotent.get(job.idempotency_key) == job.id:
+                del self._idempotent[job.idempotency_key]
+
+    def cancel(self, job):
+        """Cancel a queued or running job; returns False if it already finished
+
+        Waiting scheduler tickets are withdrawn and the job's prompts are deleted from ComfyUI's
+        queue, or interrupted on the backend executing them. Other requests' prompts keep running.
+        """
+        with self._lock:
+            if job.done.is_set():
+                return False
+            if job.cancelled:
+                return True
+            job.cancelled = True
+        logger.info(f"Cancelling job {job.id}")
+        self._forget_key(job)
+        for ticket in job.tickets:
+            scheduler.withdraw(ticket)
+        for generation in list(job.generations):
+            self.cancel_generation(job, generation)
+        return True
+
+    def cancel_generation(self, job, generation):
+        """Remove one of a cancelled job's prompts from ComfyUI"""
+        try:
+            generation.cancel()
+        except Exception as e:
+            logger.warning(f"Could not cancel a prompt of job {job.id}: {str(e)}")
+
+    def create(self, workflow_name, progress=None):
+        """Register a new queued job"""
+        job = Job(workflow_name, progress)
+        with self._lock:
+            self._evict_expired()
+            self._jobs[job.id] = job
+        return job
+
+    def run_coroutine(self, coroutine):
+        """Schedule a coroutine on the job event loop from any thread, returning a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._event_loop())
+
+    def _event_loop(self):
+        """Start the background event loop on first use"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='comfy-job-loop', daemon=True).start()
+            return self._loop
+
+    def get(self, job_id):
+        """Return the job with the given id, or None if unknown or expired"""
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args):
+        self._started(job)
+        try:
+            job.result = fn(*args)
+            job.status = 'completed'
+        except AdmissionDeferred as e:
+            # Neither the cache nor an in-flight generation had the result; wait for a slot off the pool
+            job.status = 'queued'
+            job.progress.publish('status', {'status': job.status})
+            self._park(job, e.tickets, fn, args)
+            return
+        except Exception as e:
+            self._failed(job, e)
+        self._finished(job)
+
+    def _park(self, job, tickets, fn, args):
+        """Run the job on a worker once its first ticket is admitted, failing it after EXECUTION_TIMEOUT"""
+        self._event_loop().call_soon_threadsafe(
+            lambda: self._loop.call_later(EXECUTION_TIMEOUT, self._expire, job, tickets))
+        scheduler.acquire_later(tickets[0], lambda: self._executor.submit(self._run, job, fn, args))
+
+    async def _run_async(self, job, coroutine_fn, args):
+        self._started(job)
+        try:
+            job.result = await coroutine_fn(*args)
+            job.status = 'completed'
+        except Exception as e:
+            self._failed(job, e)
+        finally:
+            self._finished(job)
+
+    def _expire(self, job, tickets):
+        # Fail a job whose first ticket was never admitted, as acquire() would have timed out
+        if scheduler.cancel(tickets[0]):
+            for ticket in tickets[1:]:
+                scheduler.release(ticket)
+            self._failed(job, TimeoutError(f"Request waited more than {EXECUTION_TIMEOUT} seconds for a generation slot"))
+            self._finished(job)
+
+    def _started(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        job.progress.publish('status', {'status': job.status})
+
+    def _failed(self, job, e):
+        if job.cancelled:
+            return  # _finished reports the job as cancelled
+        message, error_type, _ = describe_error(e)
+        metrics.inc('illustrify_errors_total', error_type=error_type)
+        logger.error(f"Job {job.id} failed: {str(e)}")
+        if error_type == 'internal_error':
+            logger.error(traceback.format_exc())
+        job.error = message
+        job.error_type = error_type
+        job.exception = e
+        job.status = 'failed'
+        if error_type in RETRYABLE_ERROR_TYPES:
+            self._forget_key(job)
+
+    def _finished(self, job):
+        if job.cancelled:
+            job.result = None
+            job.error, job.error_type, _ = describe_error(GenerationCancelled())
+            job.exception = GenerationCancelled()
+            job.status = 'cancelled'
+        job.finished_at = time.time()
+        job.progress.publish('status', job.to_dict(include_result=False))
+        job.progress.close()
+        job.done.set()
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._idempotent.get(job.idempotency_key) == job_id:
+                del self._idempotent[job.idempotency_key]
+
+job_manager = JobManager()
+
+def wants_async(data):
+    """Check whether the caller asked for submit/poll instead of a blocking response"""
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    value = data.get('async', False) if data else False
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def run_scheduled(fn, args, options):
+    """Call fn(*args, options) and give its scheduler ticket back afterwards"""
+    metrics.inc('illustrify_generations_in_flight', workflow=options['workflow'])
+    deferred = False
+    try:
+        return attach_profiles(postprocess_result(fn(*args, options), options), options)
+    except AdmissionDeferred:
+        deferred = True  # The job keeps its tickets while it waits for a slot
+        raise
+    finally:
+        if not deferred:
+            release_tickets(options)
+        metrics.inc('illustrify_generations_in_flight', -1, workflow=options['workflow'])
+
+async def run_scheduled_async(fn, args, options):
+    """run_scheduled for coroutine runners"""
+    metrics.inc('illustrify_generations_in_flight', workflow=options['workflow'])
+    try:
+        return attach_profiles(await postprocess_result_async(await fn(*args, options), options), options)
+    finally:
+        release_tickets(options)
+        metrics.inc('illustrify_generations_in_flight', -1, workflow=options['workflow'])
+
+def release_tickets(options):
+    """Give back every scheduler ticket of a request; tickets already released are skipped"""
+    for ticket in options.get('tickets', ()):
+        scheduler.release(ticket)
+
+def attach_profiles(result, options):
+    """Attach the collected node profiles to a result when the caller asked for them"""
+    if options.get('profiles') is not None and isinstance(result, GenerationResult) and result.profile is None:
+        result.profile = options['profiles']
+    return result
+
+def respond(workflow_name, data, options, fn, *args, prompts=1):
+    """Run fn(*args, options) inline, or submit it as a job when the caller opted into async mode
+
+    A scheduler ticket per prompt is taken first so an overloaded server rejects the request right away.
+    A batch with options['stream'] set runs as a coroutine job whose prompts are streamed as they finish.
+    """
+    options['workflow'] = workflow_name
+    is_async = wants_async(data)
+    streaming = options.get('stream') is not None
+    if is_async and streaming:
+        raise ValueError('stream cannot be combined with async; follow the job\'s events_url instead')
+    if is_async or streaming:
+        options['progress'] = ProgressStream(previews=options['preview'])
+    
+    # A repeated Idempotency-Key gets the original request's job and result instead of new GPU work
+    job = None
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        if len(idempotency_key) > 255:
+            raise ValueError('Idempotency-Key must be at most 255 characters')
+        job, created = job_manager.claim(workflow_name, (options['client_id'], idempotency_key), options.get('progress'))
+        if not created:
+            if job.workflow_name != workflow_name:
+                raise ValueError('Idempotency-Key was already used for a different endpoint')
+            logger.info(f"Idempotency-Key matched job {job.id}")
+            metrics.inc('illustrify_coalesced_requests_total', workflow=workflow_name)
+            if streaming:
+                return stream_batch(wait_for_job(job), None)
+            return job_accepted(job) if is_async else job_response(job, data)
+        options['progress'] = job.progress
+    
+    try:
+        options['models'] = workflow_registry.get(workflow_name).models
+        options['tickets'] = scheduler.enqueue(options['client_id'], prompts, options['models'])
+        options['ticket'] = options['tickets'][0]
+        if (is_async or streaming) and job is None:
+            job = job_manager.create(workflow_name, options['progress'])
+        if job is not None:
+            # DELETE /jobs/<id> reaches the job's tickets and prompts through these
+            job.tickets = options['tickets']
+            options['job'] = job
+        if streaming:
+            # Prompts run as tasks on the job event loop, whatever JOB_EXECUTION_MODE is
+            job = job_manager.submit_async(workflow_name, run_scheduled_async, ASYNC_RUNNERS[fn], args, options,
+                                           progress=options['progress'], job=job)
+        elif is_async:
+            if JOB_EXECUTION_MODE == 'async':
+                job = job_manager.submit_async(workflow_name, run_scheduled_async, ASYNC_RUNNERS[fn], args, options,
+                                               progress=options['progress'], job=job)
+            elif prompts == 1:
+                # The worker checks the result cache and in-flight generations first, and gives
+                # itself back until the scheduler admits the job if both miss
+                options['defer_admission'] = True
+                job = job_manager.submit(workflow_name, run_scheduled, fn, args, options, progress=options['progress'],
+                                         job=job)
+            else:
+                job = job_manager.submit(workflow_name, run_scheduled, fn, args, options, progress=options['progress'],
+                                         job=job, tickets=options['tickets'])
+    except Exception:
+        # A claimed job that never started would stay queued under its Idempotency-Key forever
+        if job is not None and job.status == 'queued':
+            job_manager.discard(job)
+        for ticket in options.get('tickets', ()):
+            scheduler.cancel(ticket)
+        raise
+    if is_async:
+        return job_accepted(job)
+    if streaming:
+        return stream_batch(job, options['stream'])
+    if job is not None:
+        return job_response(job_manager.run(job, run_scheduled, fn, args, options), data)
+    result = run_scheduled(fn, args, options)
+    with metrics.time('encode', workflow_name):
+        return render_result(result, data)
+
+def job_accepted(job):
+    """202 response pointing at a submitted job"""
+    response = jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f"/jobs/{job.id}",
+        'events_url': f"/jobs/{job.id}/events"
+    })
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response, 202
+
+def wait_for_job(job):
+    """Wait for a job to finish and return it, re-raising its error"""
+    if not job.done.wait(EXECUTION_TIMEOUT):
+        raise TimeoutError(f"Job {job.id} did not finish within {EXECUTION_TIMEOUT} seconds")
+    if job.status in ('failed', 'cancelled'):
+        raise job.exception
+    return job
+
+def job_response(job, data):
+    """Wait for a job and render its result like a blocking request, re-raising its error"""
+    wait_for_job(job)
+    with metrics.time('encode', job.workflow_name):
+        return render_result(job.result, data)
+
+def stream_batch(job, batch):
+    """Stream a batch job's prompts as NDJSON lines as they finish; a client that disconnects cancels the job
+
+    batch is the BatchResult the job fills in, or None to replay a finished job's result.
+    """
+    if batch is None:
+        if not isinstance(job.result, BatchResult):
+            raise ValueError('Idempotency-Key was already used for a different endpoint')
+        batch = job.result
+    
+    def generate():
+        sent = set()
+        try:
+            for index, outcome in batch.follow(job.done):
+                sent.add(index)
+                yield json.dumps(batch_item_dict(index, outcome)) + '\n'
+            # Prompts that never finished get the error that ended the job
+            if job.exception is not None:
+                for index in range(len(batch.items)):
+                    if index not in sent:
+                        yield json.dumps(batch_item_dict(index, job.exception)) + '\n'
+        finally:
+            if not job.done.is_set():
+                logger.info(f"Stream of job {job.id} was closed early")
+                job_manager.cancel(job)
+            if job.idempotency_key is None:
+                job_manager.discard(job)  # Nobody can ask for the result again
+    
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['X-Job-Id'] = job.id
+    return response
+
+def read_request_image(data):
+    """Read the input image from a multipart upload or a base64 JSON field"""
+    if request.content_type and 'multipart/form-data' in request.content_type:
+        if 'image' not in request.files:
+            raise ValueError('No image file provided')
+        image_file = request.files['image']
+        return image_file.read(), image_file.filename or 'uploaded_image.jpg'
+
+    if 'image' not in data:
+        raise ValueError('No image data provided')
+
+    # Decode base64 image
+    try:
+        image_b64 = data['image']
+        if ',' in image_b64:  # Remove data URL prefix if present
+            image_b64 = image_b64.split(',')[1]
+        image_data = base64.b64decode(image_b64)
+    except Exception as e:
+        raise ValueError(f'Invalid image data: {str(e)}')
+    return image_data, data.get('filename', 'uploaded_image.jpg')
+
+def execution_options(data):
+    """Read per-request execution options that are not workflow parameters"""
+    data = data or {}
+    retrieval = data.get('retrieval', OUTPUT_RETRIEVAL)
+    if retrieval not in OUTPUT_RETRIEVAL_MODES:
+        raise ValueError(f"retrieval must be one of: {', '.join(OUTPUT_RETRIEVAL_MODES)}")
+    
+    # Only a caller-supplied seed makes the run reproducible enough to cache
+    use_cache = data.get('cache', True)
+    if isinstance(use_cache, str):
+        use_cache = use_cache.lower() not in ('0', 'false', 'no')
+    
+    # Preview frames are streamed on the job's event stream, so they only apply to async jobs
+    preview = data.get('preview', False)
+    if isinstance(preview, str):
+        preview = preview.lower() in ('1', 'true', 'yes')
+    
+    # Image outputs are transcoded from ComfyUI's PNG after generation; cached results stay PNG
+    output_format = str(data.get('output_format', 'png')).lower()
+    output_format = 'jpeg' if output_format == 'jpg' else output_format
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of: {', '.join(OUTPUT_FORMATS)}")
+    if not output_format_available(output_format):
+        raise ValueError(f"{output_format} output is not available on this server (AVIF needs pillow-avif-plugin)")
+    quality = int(data.get('quality', OUTPUT_QUALITY))
+    if not (1 <= quality <= 100):
+        raise ValueError('quality must be between 1 and 100')
+    
+    # Thumbnails are cut from the decoded output: true for THUMBNAIL_SIZES, or a list / comma-separated sizes
+    thumbnails = data.get('thumbnails', False)
+    if isinstance(thumbnails, str):
+        lowered = thumbnails.lower()
+        thumbnails = lowered in ('1', 'true', 'yes') or ([] if lowered in ('', '0', 'false', 'no') else thumbnails.split(','))
+    if thumbnails is True:
+        thumbnails = THUMBNAIL_SIZES
+    elif thumbnails in (False, None):
+        thumbnails = []
+    if not isinstance(thumbnails, list) or len(thumbnails) > MAX_THUMBNAIL_SIZES:
+        raise ValueError(f"thumbnails must be true or a list of at most {MAX_THUMBNAIL_SIZES} sizes such as \"100x100\"")
+    
+    # Per-node timings are collected for every prompt, but only returned on request
+    profile = data.get('profile', False)
+    if isinstance(profile, str):
+        profile = profile.lower() in ('1', 'true', 'yes')
+    return {
+        'retrieval': retrieval,
+        'cache': bool(use_cache) and ('seed' in data or 'seeds' in data),
+        'preview': bool(preview),
+        'profiles': [] if profile else None,
+        'output_format': output_format,
+        'quality': quality,
+        'thumbnails': [parse_thumbnail_size(size) for size in thumbnails],
+        'client_id': request.headers.get('X-Client-Id') or request.remote_addr or 'anonymous'
+    }
+
+def request_data():
+    """Return request parameters from form fields or the JSON body"""
+    if request.content_type and 'multipart/form-data' in request.content_type:
+        return request.form
+    return request.get_json()
+
+I2V_DEFAULT_NEGATIVE_PROMPT = '色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量，JPEG压缩残留，丑陋的，残缺的，多余的手指，画得不好的手部，画得不好的脸部，畸形的，毁容的，形态畸形的肢体，手指融合，静止不动的画面，杂乱的背景，三条腿，背景人很多，倒着走'
+
+def build_flux_workflow(params):
+    """Render the Flux-KREA template with the request parameters"""
+    return workflow_registry.get('flux-krea-image-gen').render(params)
+
+def image_result(params, output_images, result=None):
+    """Wrap image outputs in a GenerationResult, tagging each image with the seed and batch index that produced it"""
+    # Keep raw image bytes; they are encoded when the response is rendered
+    result = result or GenerationResult(params, {'images': 'image'})
+    for node_id, images in output_images.items():
+        for batch_index, image_data in enumerate(images):
+            # A latent batch shares one seed; (seed, batch_index) identifies each image
+            metadata = {'seed': params['seed'], 'batch_index': batch_index}
+            result.add('images', OutputFile(image_data, 'png', node_id, metadata))
+    
+    return result
+
+def run_generate_image(params, options):
+    """Execute the Flux-KREA workflow and build the /generate-image response"""
+    seeds = params.get('seeds')
+    if not seeds:
+        # Execute the workflow
+        output_images = execute_generation(build_flux_workflow(params), options)
+        return image_result(params, output_images)
+    
+    # One KSampler pass cannot use several seeds, so each seed is queued as its own prompt
+    items = [{**params, 'seed': seed} for seed in seeds]
+    return merge_seed_results(params, dict(iter_generate_images(items, options)))
+
+async def run_generate_image_async(params, options):
+    """run_generate_image for async jobs"""
+    seeds = params.get('seeds')
+    if not seeds:
+        output_images = await execute_generation_async(build_flux_workflow(params), options)
+        return image_result(params, output_images)
+    
+    items = [{**params, 'seed': seed} for seed in seeds]
+    outcomes = {}
+    async for index, outcome in iter_generate_images_async(items, options):
+        outcomes[index] = outcome
+    return merge_seed_results(params, outcomes)
+
+def merge_seed_results(params, outcomes):
+    """Combine the per-seed results of a seeds request, in seed order, failing if any seed failed"""
+    result = GenerationResult(params, {'images': 'image'})
+    for index in range(len(outcomes)):
+        if isinstance(outcomes[index], Exception):
+            raise outcomes[index]
+        result.groups['images'].extend(outcomes[index].groups['images'])
+    return result
+
+def parse_image_params(data):
+    """Extract and validate Flux-KREA parameters from request data"""
+    params = {
+        'prompt': validate_prompt(data.get('prompt', 'A beautiful landscape')),
+        'negative_prompt': validate_prompt(data.get('negative_prompt', 'Blurry, bad quality')),
+        'width': int(data.get('width', 1024)),
+        'height': int(data.get('height', 1024)),
+        'steps': int(data.get('steps', 20)),
+        'cfg': float(data.get('cfg', 1)),
+        'seed': int(data.get('seed', random.randint(1, 2**32))),
+        'num_images': int(data.get('num_images', 1))
+    }
+    
+    # Validate parameters
+    validate_image_params(params['width'], params['height'], params['steps'], params['cfg'])
+    if not (1 <= params['num_images'] <= MAX_IMAGES_PER_PROMPT):
+        raise ValueError(f"num_images must be between 1 and {MAX_IMAGES_PER_PROMPT}")
+    return params
+
+@app.route('/generate-image', methods=['POST'])
+@handle_errors
+def generate_image():
+    """Generate image using Flux-KREA workflow"""
+    with metrics.time('decode', 'flux-krea-image-gen'):
+        data = request.get_json()
+    
+    # Extract and validate parameters from request
+    params = parse_image_params(data)
+    if 'seeds' in data:
+        seeds = data['seeds']
+        if not isinstance(seeds, list) or not (1 <= len(seeds) <= MAX_IMAGES_PER_PROMPT):
+            raise ValueError(f"seeds must be a list of 1 to {MAX_IMAGES_PER_PROMPT} integers")
+        if params['num_images'] != 1:
+            raise ValueError('Use either num_images or seeds, not both')
+        params['seeds'] = [int(seed) for seed in seeds]
+        params['seed'] = params['seeds'][0]
+    
+    return respond('flux-krea-image-gen', data, execution_options(data), run_generate_image, params,
+                   prompts=len(params.get('seeds') or [None]))
+
+class BatchResult:
+    """Per-prompt results of a /generate-images batch, in request order"""
+
+    def __init__(self, size):
+        self.items = [None] * size
+        self._finished = []  # Indexes in the order their prompts finished
+        self._condition = threading.Condition()
+
+    def set(self, index, outcome):
+        with self._condition:
+            self.items[index] = outcome
+            self._finished.append(index)
+            self._condition.notify_all()
+
+    def follow(self, done):
+        """Yield (index, outcome) as prompts finish, until every prompt has or the done event is set"""
+        position = 0
+        while position < len(self.items):
+            with self._condition:
+                if position == len(self._finished) and not done.is_set():
+                    self._condition.wait(1)
+                finished = self._finished[position:]
+            if not finished and done.is_set():
+                return
+            for index in finished:
+                yield index, self.items[index]
+            position += len(finished)
+
+    def to_dict(self):
+        results = [batch_item_dict(index, outcome) for index, outcome in enumerate(self.items)]
+        return {
+            'success': any(item['success'] for item in results),
+            'results': results
+        }
+
+def batch_item_dict(index, outcome):
+    """Serialize one batch entry: a GenerationResult or the exception it failed with"""
+    if isinstance(outcome, GenerationResult):
+        return {'index': index, **outcome.to_dict()}
+    message, error_type, _ = describe_error(outcome)
+    return {'index': index, 'success': False, 'error': message, 'error_type': error_type}
+
+def iter_generate_images(items, options):
+    """Run every prompt under its own ticket, yielding (index, GenerationResult or exception) as each one finishes
+
+    Each prompt reaches ComfyUI once the scheduler admits its ticket, so other clients' requests
+    take turns with a long batch. The prompts run as tasks on the job event loop, so a batch holds
+    the calling thread only rather than a thread per prompt.
+    """
+    outcomes = queue.Queue()
+    async def run():
+        async for outcome in iter_generate_images_async(items, options):
+            outcomes.put(outcome)
+    future = job_manager.run_coroutine(run())
+    future.add_done_callback(lambda _: outcomes.put(None))
+    try:
+        while True:
+            outcome = outcomes.get()
+            if outcome is None:
+                break
+            yield outcome
+        future.result()
+    finally:
+        future.cancel()  # Stops the remaining prompts when the caller gives up early
+
+async def run_batch_prompt_async(index, params, options):
+    """Run one prompt of a batch under its own scheduler ticket, returning (index, GenerationResult or exception)"""
+    ticket = options['tickets'][index]
+    try:
+        generation = await start_generation_async(build_flux_workflow(params), {**options, 'ticket': ticket})
+        return index, batch_item_result(params, await generation.wait_async(), generation, options)
+    except Exception as e:
+        logger.error(f"Batch prompt {index} failed: {str(e)}")
+        return index, e
+    finally:
+        scheduler.release(ticket)
+
+async def iter_generate_images_async(items, options):
+    """iter_generate_images for async jobs: each prompt is awaited as a task instead of a thread"""
+    tasks = [asyncio.ensure_future(run_batch_prompt_async(index, params, options)) for index, params in enumerate(items)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def batch_item_result(params, output_images, generation, options):
+    """Build the GenerationResult of one batch prompt, with only its own profile"""
+    result = image_result(params, output_images)
+    if options.get('profiles') is not None:
+        result.profile = [generation.profile] if generation.profile else []
+    return result
+
+def run_generate_images(items, options):
+    """Execute a batch of Flux-KREA prompts and collect the results in request order
+
+    Each prompt is post-processed as soon as it finishes, while the rest of the batch is still running.
+    """
+    result = options.get('stream') or BatchResult(len(items))
+    for index, outcome in iter_generate_images(items, options):
+        result.set(index, postprocess_result(outcome, options))
+    return result
+
+async def run_generate_images_async(items, options):
+    """run_generate_images for async jobs"""
+    result = options.get('stream') or BatchResult(len(items))
+    async for index, outcome in iter_generate_images_async(items, options):
+        result.set(index, await postprocess_result_async(outcome, options))
+    return result
+
+@app.route('/generate-images', methods=['POST'])
+@handle_errors
+def generate_images():
+    """Generate a batch of images using the Flux-KREA workflow, pipelined through ComfyUI's queue"""
+    with metrics.time('decode', 'flux-krea-image-gen'):
+        data = request.get_json()
+    
+    prompts = data.get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError('prompts must be a non-empty list')
+    if len(prompts) > MAX_BATCH_SIZE:
+        raise ValueError(f"A batch can contain at most {MAX_BATCH_SIZE} prompts")
+    
+    # Top-level parameters are defaults for every prompt; entries may be strings or parameter objects
+    defaults = {key: value for key, value in data.items() if key in BATCH_SHARED_PARAMS}
+    items = []
+    for entry in prompts:
+        entry = {'prompt': entry} if isinstance(entry, str) else entry
+        if 'seeds' in entry:
+            raise ValueError('seeds is not supported inside a batch; add one prompt entry per seed instead')
+        items.append(parse_image_params({**defaults, **entry}))
+    
+    options = execution_options(data)
+    if response_options(data)[0] != 'json':
+        raise ValueError('Batches support JSON responses only; use "stream": true to receive results as they finish')
+    
+    if data.get('stream'):
+        options['stream'] = BatchResult(len(items))  # Filled in and streamed as the prompts finish
+    return respond('flux-krea-image-gen', data, options, run_generate_images, items, prompts=len(items))
+
+def run_image_to_video(params, image_data, options):
+    """Execute the WAN image-to-video workflow and build the /image-to-video response"""
+    # Render an isolated copy of the workflow with the request parameters
+    workflow = workflow_registry.get('wan-image-to-video').render(params)
+    
+    # Execute the workflow, uploading the image input (node 91)
+    logger.info(f"Executing image-to-video workflow with prompt: '{params['prompt']}'")
+    output_images = execute_generation(workflow, options, {"91": (image_data, params['original_filename'])})
+    return video_result(params, output_images)
+
+async def run_image_to_video_async(params, image_data, options):
+    """run_image_to_video for async jobs"""
+    workflow = workflow_registry.get('wan-image-to-video').render(params)
+    logger.info(f"Executing image-to-video workflow with prompt: '{params['prompt']}'")
+    output_images = await execute_generation_async(workflow, options, {"91": (image_data, params['original_filename'])})
+    return video_result(params, output_images)
+
+def video_result(params, output_images):
+    """Split image-to-video outputs into the video (node 62) and any intermediate frames"""
+    logger.info(f"Workflow execution completed. Output nodes: {list(output_images.keys())}")
+    
+    # The video output should be in node 62 (VHS_VideoCombine)
+    # But since ComfyUI returns images, we need to handle video files differently
+    # For now, we'll return the generated frames and let the client handle video creation
+    result = GenerationResult(params, {'videos': 'video', 'frames': 'image'})
+    
+    for node_id, images in output_images.items():
+        logger.info(f"Processing node {node_id} with {len(images)} outputs")
+        if node_id == "62":  # Video output node
+            # This should contain the video file, but ComfyUI API might return frames
+            for i, image_data in enumerate(images):
+                logger.info(f"Processing video output {i+1}/{len(images)}, size: {len(image_data)} bytes")
+                result.add('videos', OutputFile(image_data, 'mp4', node_id))
+        else:
+            # These are intermediate frames
+            for i, image_data in enumerate(images):
+                logger.info(f"Processing frame {i+1}/{len(images)} from node {node_id}, size: {len(image_data)} bytes")
+                result.add('frames', OutputFile(image_data, 'png', node_id))
+    
+    logger.info(f"Final result: {len(result.groups['videos'])} videos, {len(result.groups['frames'])} frames")
+    
+    return result
+
+@app.route('/image-to-video', methods=['POST'])
+@handle_errors
+def image_to_video():
+    """Generate video from image using Image-To-Video workflow"""
+    # Handle both JSON and form data
+    with metrics.time('decode', 'wan-image-to-video'):
+        data = request_data()
+        image_data, filename = read_request_image(data)
+    
+    params = {
+        'prompt': data.get('prompt', ''),
+        'negative_prompt': data.get('negative_prompt', I2V_DEFAULT_NEGATIVE_PROMPT),
+        'width': int(data.get('width', 480)),
+        'height': int(data.get('height', 832)),
+        'length': int(data.get('length', 81)),
+        'steps': int(data.get('steps', 6)),
+        'cfg': float(data.get('cfg', 1)),
+        'seed': int(data.get('seed', random.randint(1, 2**32))),
+        'frame_rate': int(data.get('frame_rate', 32)),
+        'original_filename': filename
+    }
+    
+    # Check types and ranges before queueing so async jobs fail fast
+    params = workflow_registry.get('wan-image-to-video').validate(params)
+    
+    # WanImageToVideo resizes the start image to width x height (node 89), so nothing larger is uploaded
+    with metrics.time('preprocess', 'wan-image-to-video'):
+        image_data = preprocess_input_image(image_data, cover=(params['width'], params['height']))
+    
+    return respond('wan-image-to-video', data, execution_options(data), run_image_to_video, params, image_data)
+
+def run_edit_image(params, image_data, options):
+    """Execute the Qwen Image Edit workflow and build the /edit-image response"""
+    # Render an isolated copy of the workflow with the request parameters
+    workflow = workflow_registry.get('qwen-image-edit').render(params)
+    
+    # Execute the workflow, uploading the image input (node 105)
+    output_images = execute_generation(workflow, options, {"105": (image_data, params['original_filename'])})
+    return edit_result(params, output_images)
+
+async def run_edit_image_async(params, image_data, options):
+    """run_edit_image for async jobs"""
+    workflow = workflow_registry.get('qwen-image-edit').render(params)
+    output_images = await execute_generation_async(workflow, options, {"105": (image_data, params['original_filename'])})
+    return edit_result(params, output_images)
+
+def edit_result(params, output_images):
+    """Wrap edited images in a GenerationResult"""
+    # Keep raw image bytes; they are encoded when the response is rendered
+    result = GenerationResult(params, {'images': 'image'})
+    for node_id, images in output_images.items():
+        for image_data in images:
+            result.add('images', OutputFile(image_data, 'png', node_id))
+    
+    return result
+
+@app.route('/edit-image', methods=['POST'])
+@handle_errors
+def edit_image():
+    """Edit image using Qwen Image Edit workflow"""
+    # Handle both JSON and form data
+    with metrics.time('decode', 'qwen-image-edit'):
+        data = request_data()
+        image_data, filename = read_request_image(data)
+    
+    params = {
+        'prompt': data.get('prompt', ''),
+        'negative_prompt': data.get('negative_prompt', ''),
+        'steps': int(data.get('steps', 4)),
+        'cfg': float(data.get('cfg', 1)),
+        'seed': int(data.get('seed', random.randint(1, 2**32))),
+        'original_filename': filename
+    }
+    
+    # Check types and ranges before queueing so async jobs fail fast
+    template = workflow_registry.get('qwen-image-edit')
+    params = template.validate(params)
+    
+    # ImageScaleToTotalPixels (node 93) rescales the input to a fixed megapixel count
+    with metrics.time('preprocess', 'qwen-image-edit'):
+        megapixels = template.workflow['93']['inputs']['megapixels']
+        image_data = preprocess_input_image(image_data, total_pixels=int(megapixels * 1024 * 1024))
+    
+    return respond('qwen-image-edit', data, execution_options(data), run_edit_image, params, image_data)
+
+# Coroutine versions of the runners, used for jobs when JOB_EXECUTION_MODE is 'async'
+ASYNC_RUNNERS = {
+    run_generate_image: run_generate_image_async,
+    run_generate_images: run_generate_images_async,
+    run_image_to_video: run_image_to_video_async,
+    run_edit_image: run_edit_image_async
+}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@handle_errors
+def get_job(job_id):
+    """Poll the status of an asynchronous generation job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found',
+            'error_type': 'not_found'
+        }), 404
+    
+    include_result = request.args.get('include_result', 'true').lower() not in ('0', 'false', 'no')
+    return jsonify({'success': True, **job.to_dict(include_result)})
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@handle_errors
+def cancel_job(job_id):
+    """Cancel an asynchronous generation job, stopping only its own prompts in ComfyUI"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found',
+            'error_type': 'not_found'
+        }), 404
+    
+    if not job_manager.cancel(job):
+        return jsonify({'success': False, **job.to_dict(include_result=False),
+                        'error': f'Job is already {job.status}',
+                        'error_type': 'not_cancellable'}), 409
+    # The job reports status 'cancelled' once its worker has stopped
+    return jsonify({'success': True, **job.to_dict(include_result=False)}), 202
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+@handle_errors
+def get_job_result(job_id):
+    """Return a finished job's result, honouring response_mode and include"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found',
+            'error_type': 'not_found'
+        }), 404
+    if job.status != 'completed':
+        return jsonify({'success': False, **job.to_dict(include_result=False),
+                        'error': job.error or f'Job is {job.status}',
+                        'error_type': job.error_type or 'not_ready'}), 409
+    
+    with metrics.time('encode', job.workflow_name):
+        return render_result(job.result, None)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+@handle_errors
+def get_job_events(job_id):
+    """Stream a job's status, queue position, current node and step progress as Server-Sent Events"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found',
+            'error_type': 'not_found'
+        }), 404
+    
+    # Resume after the last event a reconnecting EventSource saw
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        raise ValueError('Last-Event-ID must be an integer')
+    
+    def generate():
+        for event in job.progress.follow(after):
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            event_id, event_type, data = event
+            yield f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/preview', methods=['GET'])
+@handle_errors
+def get_job_preview(job_id):
+    """Return the newest sampler preview frame of a job as a JPEG"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found',
+            'error_type': 'not_found'
+        }), 404
+    
+    jpeg = job.progress.latest_preview
+    if jpeg is None:
+        return '', 204
+    return Response(jpeg, mimetype='image/jpeg', headers={'Cache-Control': 'no-store'})
+
+@app.route('/interrupt', methods=['POST'])
+@handle_errors
+def interrupt_generation():
+    """Interrupt the prompt of one job, or one prompt id, on the backend executing it
+
+    {"all": true} interrupts every backend whoever queued the running prompts, and is refused
+    unless ALLOW_GLOBAL_INTERRUPT is set.
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get('all'):
+        if not ALLOW_GLOBAL_INTERRUPT:
+            return jsonify({
+                'success': False,
+                'error': 'Interrupting every backend is disabled; set ALLOW_GLOBAL_INTERRUPT to allow it',
+                'error_type': 'forbidden'
+            }), 403
+        targets = [(backend, None) for backend in backend_pool.backends if backend.healthy]
+    elif data.get('job_id'):
+        job = job_manager.get(data['job_id'])
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found',
+                'error_type': 'not_found'
+            }), 404
+        targets = [(generation.backend, generation.waiter.prompt_id) for generation in list(job.generations)
+                   if generation.waiter is not None and generation.outputs is None]
+    elif data.get('prompt_id'):
+        targets = [(backend, data['prompt_id']) for backend in backend_pool.backends
+                   if backend.client.has_prompt(data['prompt_id'])]
+    else:
+        raise ValueError('job_id or prompt_id is required')
+    
+    try:
+        interrupted = []
+        for backend, prompt_id in targets:
+            if prompt_id is None:
+                backend.client.interrupt()
+            elif not backend.client.interrupt_prompt(prompt_id):
+                continue  # Still queued or already finished
+            interrupted.append({'backend': backend.address, 'prompt_id': prompt_id})
+        
+        return jsonify({
+            'success': True,
+            'message': 'Generation interrupted successfully' if interrupted else 'No matching prompt is executing',
+            'interrupted': interrupted
+        })
+        
+    except Exception as e:
+        logger.error(f"Failed to interrupt generation: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Failed to interrupt generation: {str(e)}'
+        }), 500
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    # Backend health comes from the pool's periodic /queue and /system_stats checks
+    backends = backend_pool.stats()
+    comfy_status = "connected" if any(backend['healthy'] for backend in backends) else "disconnected"
+    
+    return jsonify({
+        "status": "healthy",
+        "message": "ComfyUI Flask API is running",
+        "comfyui_status": comfy_status,
+        "server_address": backends[0]['address'],
+        "backends": backends,
+        "scheduler": scheduler.stats(),
+        "result_cache": result_cache.stats(),
+        "singleflight": generation_flights.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose request stage latencies, error counts and in-flight gauges for Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/profile', methods=['GET'])
+def node_profile():
+    """Aggregate per-node execution times for each workflow"""
+    return jsonify({'workflows': node_profiles.to_dict()})
+
+@app.route('/workflows', methods=['GET'])
+def list_workflows():
+    """List registered workflows"""
+    return jsonify({
+        "workflow_dir": workflow_registry.directory,
+        "workflows": workflow_registry.list()
     })
 
 @app.errorhandler(404)
@@ -650,5 +3681,5 @@ def method_not_allowed(error):
 
 if __name__ == '__main__':
     logger.info(f"Starting ComfyUI Flask API on port 5000")
-    logger.info(f"ComfyUI server expected at: {SERVER_ADDRESS}")
+    logger.info(f"ComfyUI servers expected at: {', '.join(COMFYUI_BACKENDS)}")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Flask API against the fake ComfyUI server
+
+Starts scripts/fake_comfyui_server.py and comfyui_flask_app.py as subprocesses on free ports, then
+drives one endpoint at each requested concurrency and input image size. Reports throughput,
+p50/p95/p99 latency and the Flask process's peak RSS. Everything runs on localhost, so it works
+offline.
+
+Usage:
+    python scripts/benchmark_flask_api.py --endpoint edit-image --concurrency 1,8,32 --input-sizes 256,1024
+    python scripts/benchmark_flask_api.py --endpoint generate-image --requests 200 --json results.json
+    python scripts/benchmark_flask_api.py --response-mode binary --num-images 2 --requests 10 --concurrency 1
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_SERVER = os.path.join(REPO_ROOT, 'scripts', 'fake_comfyui_server.py')
+
+def free_port():
+    """Ask the OS for an unused TCP port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(url, process, timeout=30):
+    """Poll url until it answers, failing early if the process died"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before {url} was ready")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} was not ready after {timeout} seconds")
+
+def peak_rss_mb(pid):
+    """Peak resident set size of a process in MB (Linux /proc, else psutil if installed)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 2**20  # Windows reports a true peak, elsewhere current RSS
+    except Exception:
+        return None
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def make_input_image(size):
+    """Base64 JPEG of a noise image, so uploads carry realistic payload sizes"""
+    image = Image.frombytes('RGB', (size, size), os.urandom(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+def build_payload(args, input_size, index):
+    """Request body for one benchmark request; every request gets its own seed so nothing is cached"""
+    payload = {'prompt': f'benchmark prompt {index}', 'steps': args.steps, 'seed': 1000 + index, 'cache': False}
+    if args.endpoint == 'generate-image':
+        payload.update(width=args.width, height=args.height, num_images=args.num_images)
+    elif args.endpoint in ('edit-image', 'image-to-video'):
+        payload['image'] = args.images[input_size]
+        if args.endpoint == 'image-to-video':
+            payload.update(length=16)
+    if args.response_mode:
+        payload['response_mode'] = args.response_mode
+    return payload
+
+def expected_outputs(args):
+    """Number of files one request should return"""
+    if args.endpoint == 'generate-image':
+        return args.num_images
+    return 1
+
+class Services:
+    """The fake ComfyUI server and the Flask API under test"""
+
+    def __init__(self, args):
+        self.args = args
+        self.comfy_port = free_port()
+        self.flask_port = free_port()
+        self.comfy = None
+        self.flask = None
+
+    def start(self):
+        args = self.args
+        self.comfy = subprocess.Popen([
+            sys.executable, FAKE_SERVER, '--port', str(self.comfy_port),
+            '--step-latency', str(args.step_latency), '--node-latency', str(args.node_latency),
+            '--image-size', args.output_size, '--video-bytes', str(args.video_bytes)
+        ], stdout=subprocess.DEVNULL)
+        wait_until_ready(f'http://127.0.0.1:{self.comfy_port}/queue', self.comfy)
+
+        env = {
+            **os.environ,
+            'COMFYUI_BACKENDS': f'127.0.0.1:{self.comfy_port}',
+            'RESULT_CACHE_MAX_BYTES': '0',
+            'SCHEDULER_MAX_QUEUE': str(10**6),
+            'SCHEDULER_PER_CLIENT': str(10**6),
+            'PYTHONPATH': REPO_ROOT
+        }
+        # Serve with the threaded development server, without the debugger and reloader
+        code = (
+            'import logging, comfyui_flask_app as app_module; '
+            'logging.disable(logging.INFO); '
+            f'app_module.app.run(host="127.0.0.1", port={self.flask_port}, threaded=True)'
+        )
+        self.flask = subprocess.Popen([sys.executable, '-c', code], env=env, cwd=REPO_ROOT,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if not args.verbose else None)
+        wait_until_ready(f'http://127.0.0.1:{self.flask_port}/health', self.flask)
+
+    def stop(self):
+        for process in (self.flask, self.comfy):
+            if process is not None and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+def run_scenario(args, concurrency, input_size):
+    """Start fresh services, send args.requests requests at the given concurrency and summarize them"""
+    services = Services(args)
+    services.start()
+    try:
+        url = f'http://127.0.0.1:{services.flask_port}/{args.endpoint}'
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+        # Warm up so template loading and the websocket connection are not measured
+        session.post(url, json=build_payload(args, input_size, -1), timeout=args.timeout)
+
+        def send(index):
+            start = time.perf_counter()
+            try:
+                response = session.post(url, json=build_payload(args, input_size, index), timeout=args.timeout)
+                size = len(response.content)
+                # A binary response must deliver every output, including multipart/mixed bodies
+                ok = response.status_code == 200 and (
+                    args.response_mode != 'binary' or int(response.headers.get('X-Output-Count', 0)) == expected_outputs(args))
+            except requests.RequestException:
+                ok, size = False, 0
+            return time.perf_counter() - start, ok, size
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(send, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for latency, ok, _ in results if ok]
+        return {
+            'endpoint': args.endpoint,
+            'concurrency': concurrency,
+            'input_size': input_size,
+            'requests': args.requests,
+            'errors': sum(1 for _, ok, _ in results if not ok),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+            'mean_response_kb': round(sum(size for _, _, size in results) / len(results) / 1024, 1),
+            'peak_rss_mb': round(peak_rss_mb(services.flask.pid) or 0, 1) or None
+        }
+    finally:
+        services.stop()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark comfyui_flask_app against the fake ComfyUI server')
+    parser.add_argument('--endpoint', default='generate-image', choices=('generate-image', 'edit-image', 'image-to-video'))
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated concurrency levels')
+    parser.add_argument('--input-sizes', default='512', help='comma-separated input image sizes in pixels (edit-image, image-to-video)')
+    parser.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--num-images', type=int, default=1, help='num_images per /generate-image request; above 1 binary responses are multipart/mixed')
+    parser.add_argument('--response-mode', choices=('json', 'binary'), help='response_mode sent with every request')
+    parser.add_argument('--output-size', default='512x512', help='WIDTHxHEIGHT of the images the fake server returns')
+    parser.add_argument('--video-bytes', type=int, default=1024 * 1024, help='size of the videos the fake server returns')
+    parser.add_argument('--step-latency', type=float, default=0.0, help='fake seconds per sampler step')
+    parser.add_argument('--node-latency', type=float, default=0.0, help='fake seconds per executed node')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the Flask server output')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    concurrency_levels = [int(value) for value in args.concurrency.split(',')]
+    input_sizes = [int(value) for value in args.input_sizes.split(',')]
+    if args.endpoint == 'generate-image':
+        input_sizes = [None]  # No input image
+    args.images = {size: make_input_image(size) for size in input_sizes} if args.endpoint != 'generate-image' else {}
+
+    columns = ('concurrency', 'input_size', 'errors', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_response_kb', 'peak_rss_mb')
+    print(f"Benchmarking /{args.endpoint}: {args.requests} requests per scenario")
+    print(' '.join(f"{column:>16}" for column in columns))
+
+    results = []
+    for input_size in input_sizes:
+        for concurrency in concurrency_levels:
+            result = run_scenario(args, concurrency, input_size)
+            results.append(result)
+            print(' '.join(f"{str(result[column]):>16}" for column in columns), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+if __name__ == '__main__':
+    main()
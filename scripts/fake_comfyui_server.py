@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Fake ComfyUI server for running and benchmarking the Flask API without a GPU
+
+Implements the parts of the ComfyUI API that comfyui_flask_app uses: /prompt, /ws, /history,
+/view, /upload/image, /queue, /interrupt and /system_stats. Prompts run one at a time like on a
+real GPU; every node sleeps for a configurable time and the output nodes return images or
+videos of a configurable size.
+
+Usage:
+    python scripts/fake_comfyui_server.py --port 8188 --step-latency 0.05 --image-size 1024x1024
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import queue
+import random
+import struct
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+IMAGE_OUTPUT_NODES = ('SaveImage', 'PreviewImage')
+
+def make_png(width, height, seed=0):
+    """Create a noise PNG, which compresses about as badly as a real generation"""
+    rng = random.Random(seed)
+    image = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+def websocket_frame(opcode, payload):
+    """Encode one unmasked server-to-client websocket frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+def loader_key(node):
+    """Identify the model a loader node loads by its class and settings"""
+    return node['class_type'], json.dumps(node['inputs'], sort_keys=True)
+
+class FakeComfyUI:
+    """Queue, history, files and websocket clients of the fake server"""
+
+    def __init__(self, args):
+        self.args = args
+        width, height = (int(value) for value in args.image_size.lower().split('x'))
+        # Pre-render the outputs so serving them costs no CPU during a benchmark
+        self.output_images = [make_png(width, height, seed) for seed in range(args.distinct_outputs)]
+        self.preview_image = make_png(64, 64)
+        self.clients = {}  # client_id -> (handler, send lock)
+        self.clients_lock = threading.Lock()
+        self.history = {}
+        self.files = {}
+        self.inputs = {}
+        self.pending = queue.Queue()
+        self.pending_ids = []
+        self.deleted = set()  # Pending prompts removed with POST /queue {"delete": [...]}
+        self.running = []
+        self.warm_nodes = OrderedDict()  # Loader nodes whose models are "in VRAM", least recently used first
+        self.interrupted = threading.Event()
+        self.prompt_number = 0
+        self.lock = threading.Lock()
+        self.counters = {'prompts': 0, 'uploads': 0, 'views': 0, 'ws_connects': 0, 'model_loads': 0}
+
+    # Websocket messages
+    def send(self, client_id, message):
+        """Send a JSON message (dict) or binary frame (bytes) to one client"""
+        with self.clients_lock:
+            client = self.clients.get(client_id)
+        if client is None:
+            return
+        handler, send_lock = client
+        if isinstance(message, dict):
+            frame = websocket_frame(0x1, json.dumps(message).encode('utf-8'))
+        else:
+            frame = websocket_frame(0x2, message)
+        try:
+            with send_lock:
+                handler.wfile.write(frame)
+                handler.wfile.flush()
+        except OSError:
+            pass
+
+    def broadcast_status(self):
+        """Tell every client how many prompts are left, like ComfyUI does when its queue changes"""
+        message = {'type': 'status', 'data': {'status': {'exec_info': {'queue_remaining': len(self.pending_ids) + len(self.running)}}}}
+        with self.clients_lock:
+            client_ids = list(self.clients)
+        for client_id in client_ids:
+            self.send(client_id, message)
+
+    def delete(self, prompt_ids):
+        """Drop pending prompts, like POST /queue {"delete": [...]}"""
+        with self.lock:
+            for number, prompt_id in list(self.pending_ids):
+                if prompt_id in prompt_ids:
+                    self.pending_ids.remove((number, prompt_id))
+                    self.deleted.add(prompt_id)
+        self.broadcast_status()
+
+    # Prompt execution
+    def submit(self, prompt, client_id, prompt_id=None):
+        prompt_id = prompt_id or str(uuid.uuid4())
+        with self.lock:
+            self.prompt_number += 1
+            number = self.prompt_number
+            self.pending_ids.append((number, prompt_id))
+            self.counters['prompts'] += 1
+        self.pending.put((number, prompt_id, prompt, client_id))
+        self.broadcast_status()
+        return prompt_id, number
+
+    def worker(self):
+        """Run queued prompts one at a time"""
+        while True:
+            number, prompt_id, prompt, client_id = self.pending.get()
+            with self.lock:
+                if prompt_id in self.deleted:
+                    self.deleted.discard(prompt_id)
+                    continue
+                self.pending_ids.remove((number, prompt_id))
+                self.running.append((number, prompt_id))
+            self.interrupted.clear()
+            self.broadcast_status()
+            try:
+                status = self.execute(prompt_id, prompt, client_id)
+            finally:
+                with self.lock:
+                    self.running.remove((number, prompt_id))
+            self.history[prompt_id]['status'] = status
+            self.send(client_id, {'type': 'executing', 'data': {'node': None, 'prompt_id': prompt_id}})
+            self.broadcast_status()
+
+    def execute(self, prompt_id, prompt, client_id):
+        args = self.args
+        outputs = {}
+        self.history[prompt_id] = {'prompt': [0, prompt_id, prompt, {}, []], 'outputs': outputs, 'status': {}}
+        self.send(client_id, {'type': 'execution_start', 'data': {'prompt_id': prompt_id}})
+
+        # Loaders of models already in VRAM are cached, like ComfyUI's node output cache
+        cached = [node_id for node_id, node in prompt.items()
+                  if 'Loader' in node['class_type'] and loader_key(node) in self.warm_nodes]
+        for node_id in cached:
+            self.warm_nodes.move_to_end(loader_key(prompt[node_id]))
+        if cached:
+            self.send(client_id, {'type': 'execution_cached', 'data': {'nodes': cached, 'prompt_id': prompt_id}})
+
+        batch_size = 1
+        for node in prompt.values():
+            value = node['inputs'].get('batch_size')
+            if isinstance(value, int):
+                batch_size = value
+
+        for node_id, node in prompt.items():
+            if node_id in cached:
+                continue
+            if self.interrupted.is_set():
+                self.send(client_id, {'type': 'execution_interrupted', 'data': {'prompt_id': prompt_id, 'node_id': node_id}})
+                return {'status_str': 'error', 'completed': False}
+
+            class_type = node['class_type']
+            self.send(client_id, {'type': 'executing', 'data': {'node': node_id, 'prompt_id': prompt_id}})
+            time.sleep(args.node_latency)
+
+            if 'Loader' in class_type:
+                time.sleep(args.load_latency)
+                self.counters['model_loads'] += 1
+                if not args.no_model_cache:
+                    self.warm_nodes[loader_key(node)] = True
+                    # Loading past the VRAM budget evicts the least recently used models
+                    while args.max_loaded_models and len(self.warm_nodes) > args.max_loaded_models:
+                        self.warm_nodes.popitem(last=False)
+            elif class_type.startswith('KSampler'):
+                steps = int(node['inputs'].get('steps', 20))
+                for step in range(steps):
+                    time.sleep(args.step_latency)
+                    self.send(client_id, {'type': 'progress', 'data': {'value': step + 1, 'max': steps, 'prompt_id': prompt_id, 'node': node_id}})
+                    if args.previews:
+                        # Event type 1 (preview image), image format 2 (PNG)
+                        self.send(client_id, struct.pack('>II', 1, 2) + self.preview_image)
+            elif class_type in IMAGE_OUTPUT_NODES:
+                images = []
+                for index in range(batch_size):
+                    filename = f"{class_type}_{uuid.uuid4().hex}.png"
+                    self.files[filename] = self.output_images[index % len(self.output_images)]
+                    images.append({'filename': filename, 'subfolder': '', 'type': 'output' if class_type == 'SaveImage' else 'temp'})
+                outputs[node_id] = {'images': images}
+                self.send(client_id, {'type': 'executed', 'data': {'node': node_id, 'output': outputs[node_id], 'prompt_id': prompt_id}})
+            elif class_type == 'SaveImageWebsocket':
+                for index in range(batch_size):
+                    self.send(client_id, struct.pack('>II', 1, 2) + self.output_images[index % len(self.output_images)])
+            elif class_type == 'VHS_VideoCombine':
+                filename = f"video_{uuid.uuid4().hex}.mp4"
+                self.files[filename] = b'\x00\x00\x00\x18ftypmp42' + os.urandom(args.video_bytes)
+                outputs[node_id] = {'gifs': [{'filename': filename, 'subfolder': '', 'type': 'output', 'format': 'video/h264-mp4'}]}
+                self.send(client_id, {'type': 'executed', 'data': {'node': node_id, 'output': outputs[node_id], 'prompt_id': prompt_id}})
+
+        self.send(client_id, {'type': 'execution_success', 'data': {'prompt_id': prompt_id}})
+        return {'status_str': 'success', 'completed': True}
+
+class FakeComfyUIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeComfyUI/1.0'
+
+    @property
+    def comfy(self):
+        return self.server.comfy
+
+    def log_message(self, format, *args):
+        if self.server.comfy.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+
+        if url.path == '/ws':
+            return self.serve_websocket(query.get('clientId', [uuid.uuid4().hex])[0])
+
+        if url.path.startswith('/history'):
+            prompt_id = url.path[len('/history/'):]
+            if not prompt_id:
+                return self.send_json(self.comfy.history)
+            entry = self.comfy.history.get(prompt_id)
+            # Like ComfyUI, a prompt only appears in the history once it has finished
+            return self.send_json({prompt_id: entry} if entry and entry['status'] else {})
+
+        if url.path == '/view':
+            self.comfy.counters['views'] += 1
+            filename = query.get('filename', [''])[0]
+            data = self.comfy.files.get(filename) or self.comfy.inputs.get(filename)
+            if data is None:
+                return self.send_json({'error': 'File not found'}, 404)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png' if filename.endswith('.png') else 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if url.path == '/queue':
+            with self.comfy.lock:
+                return self.send_json({
+                    'queue_running': [[number, prompt_id, {}, {}, []] for number, prompt_id in self.comfy.running],
+                    'queue_pending': [[number, prompt_id, {}, {}, []] for number, prompt_id in self.comfy.pending_ids]
+                })
+
+        if url.path == '/system_stats':
+            return self.send_json({
+                'system': {'os': 'fake', 'comfyui_version': 'fake'},
+                'devices': [{'name': 'fake-gpu', 'type': 'cuda', 'vram_total': 24 * 2**30, 'vram_free': 20 * 2**30}]
+            })
+
+        if url.path == '/fake/stats':
+            return self.send_json(self.comfy.counters)
+
+        self.send_json({'error': 'Not found'}, 404)
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if url.path == '/prompt':
+            try:
+                request_body = json.loads(body)
+                prompt = request_body['prompt']
+            except (ValueError, KeyError):
+                return self.send_json({'error': {'type': 'invalid_prompt', 'message': 'Invalid prompt'}, 'node_errors': {}}, 400)
+            # Like ComfyUI, reject prompts whose LoadImage file is not in the input folder
+            missing = [node_id for node_id, node in prompt.items()
+                       if node.get('class_type') == 'LoadImage' and node['inputs'].get('image') not in self.comfy.inputs]
+            if missing:
+                return self.send_json({'error': {'type': 'prompt_outputs_failed_validation',
+                                                 'message': 'Prompt outputs failed validation'},
+                                       'node_errors': {node_id: {'errors': [{'type': 'value_not_in_list'}]} for node_id in missing}}, 400)
+            prompt_id, number = self.comfy.submit(prompt, request_body.get('client_id'), request_body.get('prompt_id'))
+            return self.send_json({'prompt_id': prompt_id, 'number': number, 'node_errors': {}})
+
+        if url.path == '/upload/image':
+            return self.upload_image(body)
+
+        if url.path == '/queue':
+            self.comfy.delete(set(json.loads(body or b'{}').get('delete', [])))
+            return self.send_json({})
+
+        if url.path == '/interrupt':
+            # Like ComfyUI, a prompt_id only interrupts that prompt, and only while it is running
+            prompt_id = json.loads(body or b'{}').get('prompt_id')
+            with self.comfy.lock:
+                running = [running_id for _, running_id in self.comfy.running]
+            if prompt_id is None or prompt_id in running:
+                self.comfy.interrupted.set()
+            return self.send_json({})
+
+        if url.path == '/fake/clear-inputs':
+            # Simulates a restart or a cleaned input folder
+            self.comfy.inputs.clear()
+            return self.send_json({})
+
+        self.send_json({'error': 'Not found'}, 404)
+
+    def upload_image(self, body):
+        self.comfy.counters['uploads'] += 1
+        boundary = self.headers.get('Content-Type', '').split('boundary=')[-1].encode('utf-8')
+        name, data, overwrite = 'image.png', b'', False
+        for part in body.split(b'--' + boundary):
+            head, separator, content = part.partition(b'\r\n\r\n')
+            if not separator:
+                continue
+            content = content[:-2]  # Trailing CRLF before the next boundary
+            if b'name="image"' in head:
+                name = head.split(b'filename="')[1].split(b'"')[0].decode('utf-8')
+                data = content
+            elif b'name="overwrite"' in head:
+                overwrite = content.strip() == b'true'
+
+        # Without overwrite ComfyUI renames a clashing upload instead of replacing it
+        if name in self.comfy.inputs and not overwrite and self.comfy.inputs[name] != data:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem} (1){extension}"
+        self.comfy.inputs[name] = data
+        self.send_json({'name': name, 'subfolder': '', 'type': 'input'})
+
+    def serve_websocket(self, client_id):
+        self.comfy.counters['ws_connects'] += 1
+        accept = base64.b64encode(hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WEBSOCKET_GUID).encode('utf-8')).digest())
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode('utf-8'))
+        self.end_headers()
+        self.wfile.flush()
+
+        with self.comfy.clients_lock:
+            self.comfy.clients[client_id] = (self, threading.Lock())
+        self.comfy.send(client_id, {'type': 'status', 'data': {
+            'status': {'exec_info': {'queue_remaining': len(self.comfy.pending_ids)}}, 'sid': client_id}})
+        try:
+            # Read (and ignore) client frames until the client closes
+            while True:
+                header = self.rfile.read(2)
+                if len(header) < 2:
+                    break
+                opcode, length = header[0] & 0x0F, header[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack('!H', self.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack('!Q', self.rfile.read(8))[0]
+                masked = header[1] & 0x80
+                self.rfile.read((4 if masked else 0) + length)
+                if opcode == 0x8:
+                    break
+        finally:
+            with self.comfy.clients_lock:
+                if self.comfy.clients.get(client_id, (None,))[0] is self:
+                    del self.comfy.clients[client_id]
+            self.close_connection = True
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Fake ComfyUI server for testing and benchmarking the Flask API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8188)
+    parser.add_argument('--node-latency', type=float, default=0.0, help='seconds every executed node takes')
+    parser.add_argument('--step-latency', type=float, default=0.01, help='seconds per sampler step')
+    parser.add_argument('--load-latency', type=float, default=0.0, help='extra seconds a loader node takes when its model is not cached')
+    parser.add_argument('--no-model-cache', action='store_true', help='run loader nodes on every prompt')
+    parser.add_argument('--max-loaded-models', type=int, default=0,
+                        help='loader outputs kept "in VRAM" at once, least recently used evicted first (0 = unlimited)')
+    parser.add_argument('--image-size', default='512x512', help='WIDTHxHEIGHT of generated images')
+    parser.add_argument('--distinct-outputs', type=int, default=2, help='number of different output images to cycle through')
+    parser.add_argument('--video-bytes', type=int, default=1024 * 1024, help='size of generated videos')
+    parser.add_argument('--previews', action='store_true', help='send binary preview frames during sampling')
+    parser.add_argument('--verbose', action='store_true', help='log every HTTP request')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    comfy = FakeComfyUI(args)
+    threading.Thread(target=comfy.worker, name='fake-comfy-worker', daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeComfyUIHandler)
+    server.daemon_threads = True
+    server.comfy = comfy
+    print(f"Fake ComfyUI listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { cookies } from 'next/headers';
 import pb, { pbHelpers, Animation } from '@/lib/pocketbase';
-import { Agent, request as undiciRequest } from 'undici';
 
 // Configure API route timeout to 20 minutes
 export const maxDuration = 1200; // 20 minutes in seconds
@@ -24,20 +23,27 @@ interface AnimateImageRequest {
   frame_rate?: number;
 }
 
-interface FlaskResponse {
+interface FlaskJobResponse {
   success: boolean;
-  videos?: Array<{
-    video: string;
-    format: string;
-  }>;
-  frames?: Array<{
-    image: string;
-    format: string;
-  }>;
-  parameters?: any;
+  job_id?: string;
+  status?: 'queued' | 'running' | 'completed' | 'failed';
   error?: string;
 }
 
+const FLASK_SERVER = process.env.FLASK_SERVER || 'http://127.0.0.1:5000';
+const JOB_POLL_INTERVAL_MS = 3000;
+const JOB_TIMEOUT_MS = 20 * 60 * 1000; // 20 minutes
+
+async function readFlaskJson<T>(response: Response): Promise<T> {
+  const text = await response.text();
+  try {
+    return JSON.parse(text);
+  } catch (err) {
+    console.error('Failed to parse Flask response:', text.substring(0, 1000));
+    throw new Error('Invalid JSON from Flask server');
+  }
+}
+
 async function animateImageWithFlask(params: {
   image: string;
   prompt?: string; // Optional prompt
@@ -49,73 +55,66 @@ async function animateImageWithFlask(params: {
   cfg?: number;
   seed?: number;
   frame_rate?: number;
-}): Promise<Buffer> {
-  // Extend undici timeouts to allow long-running generation before response headers are sent
-  const agent = new Agent({
-    headersTimeout: 20 * 60 * 1000, // 20 minutes
-    bodyTimeout: 20 * 60 * 1000, // 20 minutes
-    keepAliveTimeout: 70_000,
-  });
-
+}, clientId: string): Promise<Buffer> {
   try {
-    const { statusCode, body } = await undiciRequest('http://127.0.0.1:5000/image-to-video', {
+    // Submit the generation as an async job so no connection is held open while ComfyUI works
+    const submitResponse = await fetch(`${FLASK_SERVER}/image-to-video`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(params),
-      dispatcher: agent,
-      headersTimeout: 20 * 60 * 1000,
-      bodyTimeout: 20 * 60 * 1000,
+      // Identify the user so Flask can share generation slots fairly between users
+      headers: { 'Content-Type': 'application/json', 'X-Client-Id': clientId },
+      body: JSON.stringify({ ...params, async: true }),
     });
+    const submitted = await readFlaskJson<FlaskJobResponse>(submitResponse);
 
-    if (statusCode < 200 || statusCode >= 300) {
-      const text = await body.text();
-      let error = 'Flask server error';
-      try {
-        const parsed = JSON.parse(text);
-        error = parsed?.error || error;
-      } catch {}
-      throw new Error(error);
+    if (!submitResponse.ok || !submitted.job_id) {
+      throw new Error(submitted.error || 'Flask server error');
     }
 
-    const text = await body.text();
-    console.log('Flask response text:', text.substring(0, 500) + '...');
-    
-    let data: FlaskResponse;
-    try {
-      data = JSON.parse(text);
-    } catch (err) {
-      console.error('Failed to parse Flask response:', text.substring(0, 1000));
-      throw new Error('Invalid JSON from Flask server');
-    }
+    console.log('Submitted image-to-video job:', submitted.job_id);
 
-    console.log('Parsed Flask response:', {
-      success: data.success,
-      videosCount: data.videos?.length || 0,
-      framesCount: data.frames?.length || 0,
-      hasError: !!data.error
-    });
+    // Poll the job until it finishes
+    const deadline = Date.now() + JOB_TIMEOUT_MS;
+    let completed = false;
+    while (Date.now() < deadline) {
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
 
-    if (!data.success) {
-      throw new Error(data.error || 'Video generation failed');
+      const pollResponse = await fetch(`${FLASK_SERVER}/jobs/${submitted.job_id}?include_result=false`, { cache: 'no-store' });
+      const job = await readFlaskJson<FlaskJobResponse>(pollResponse);
+
+      if (!pollResponse.ok) {
+        throw new Error(job.error || 'Failed to poll Flask job');
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Video generation failed');
+      }
+      if (job.status === 'completed') {
+        completed = true;
+        break;
+      }
     }
 
-    // Return the first video if available, otherwise return first frame
-    if (data.videos && data.videos.length > 0) {
-      console.log('Returning video data, format:', data.videos[0].format);
-      return Buffer.from(data.videos[0].video, 'base64');
-    } else if (data.frames && data.frames.length > 0) {
-      console.log('Returning frame data as fallback, format:', data.frames[0].format);
-      return Buffer.from(data.frames[0].image, 'base64');
+    if (!completed) {
+      throw new Error('Timed out waiting for video generation');
     }
 
-    console.error('No video or frames in response:', data);
-    throw new Error('No video or frames generated');
+    // Download the video as raw bytes rather than base64 inside JSON
+    const resultResponse = await fetch(
+      `${FLASK_SERVER}/jobs/${submitted.job_id}/result?response_mode=binary&include=videos`,
+      { cache: 'no-store' }
+    );
+    if (!resultResponse.ok) {
+      const failure = await readFlaskJson<FlaskJobResponse>(resultResponse);
+      throw new Error(failure.error || 'No video generated');
+    }
+
+    console.log('Received video from Flask:', {
+      contentType: resultResponse.headers.get('content-type'),
+      contentLength: resultResponse.headers.get('content-length')
+    });
+    return Buffer.from(await resultResponse.arrayBuffer());
   } catch (error) {
     console.error('Flask API error:', error);
     throw error;
-  } finally {
-    // Close the agent to free sockets after each request
-    agent.close();
   }
 }
 
@@ -214,7 +213,7 @@ export async function POST(request: NextRequest) {
       cfg,
       seed,
       frame_rate,
-    });
+    }, userId);
 
     // Save video to PocketBase animations collection
     try {
@@ -29,10 +29,11 @@ async function fetchAsBase64(url: string): Promise<string> {
   return buf.toString('base64');
 }
 
-async function editImageWithFlask(imageB64: string, prompt: string, steps: number = 20) {
+async function editImageWithFlask(imageB64: string, prompt: string, steps: number, clientId: string) {
   const response = await fetch(`${FLASK_SERVER}/edit-image`, {
     method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
+    // Identify the user so Flask can share generation slots fairly between users
+    headers: { 'Content-Type': 'application/json', 'X-Client-Id': clientId },
     body: JSON.stringify({ image: imageB64, prompt, steps })
   });
   if (!response.ok) {
@@ -122,7 +123,7 @@ export async function POST(request: Request) {
       return NextResponse.json({ error: 'No image provided' }, { status: 400 });
     }
 
-    const imageBuffer = await editImageWithFlask(imageB64!, prompt, steps || 20);
+    const imageBuffer = await editImageWithFlask(imageB64!, prompt, steps || 20, userId);
     if (!imageBuffer) {
       return NextResponse.json({ error: 'Failed to edit image' }, { status: 500 });
     }
@@ -187,7 +187,7 @@ export async function POST(req: Request) {
             console.log(`[Generate Scenes API] Generating image for scene ${i + 1}`);
             // Convert quality string to number: low=20, high=30, max=35
             const qualityValue = quality === 'high' ? 30 : quality === 'max' ? 35 : 20;
-            const imageResult = await generateSceneImage(scene.imageDescription, qualityValue);
+            const imageResult = await generateSceneImage(scene.imageDescription, qualityValue, user.id);
             console.log(`[Generate Scenes API] Image generation result for scene ${i + 1}:`, {
               success: imageResult.success,
               hasImageUrl: !!imageResult.imageUrl
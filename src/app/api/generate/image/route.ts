@@ -27,17 +27,19 @@ function extractUserIdFromToken(token?: string | null): string | undefined {
 }
 
 // Generate image using Flask server
-async function generateImageWithFlask(prompt: string, seed?: number, steps: number = 20, width: number = 1024, height: number = 1024): Promise<Buffer | null> {
+async function generateImageWithFlask(prompt: string, seed: number | undefined, steps: number, width: number, height: number, clientId: string): Promise<Buffer | null> {
   try {
     const response = await fetch(`${FLASK_SERVER}/generate-image`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      // Identify the user so Flask can share generation slots fairly between users
+      headers: { 'Content-Type': 'application/json', 'X-Client-Id': clientId },
       body: JSON.stringify({
         prompt: prompt,
         negative_prompt: "blurry, low quality, distorted",
         steps: steps,
         cfg: 1.0,
-        seed: seed || Math.floor(Math.random() * 4294967296),
+        // Without a seed Flask picks a random one and skips its result cache
+        ...(seed ? { seed } : {}),
         width: width,
         height: height
       }),
@@ -161,7 +163,7 @@ export async function POST(request: Request) {
     console.log(`[Flask] Generating image for prompt: "${prompt.slice(0, 50)}..."`); 
 
     // Generate image using Flask server
-    const imageBuffer = await generateImageWithFlask(prompt, seed, steps || 20, width || 1024, height || 1024);
+    const imageBuffer = await generateImageWithFlask(prompt, seed, steps || 20, width || 1024, height || 1024, userId);
     
     if (!imageBuffer) {
       return NextResponse.json({ error: 'Failed to generate image' }, { status: 500 });
@@ -71,7 +71,7 @@ export async function POST(req: Request) {
         const result = await generateVideo(story, style, {
           ttsEngine: selectedTtsEngine,
           voice: selectedVoice
-        }, qualityValue);
+        }, qualityValue, user.id);
         
         if (result.success && result.videoUrl) {
           const videoTitle = (story as string).slice(0, 80) + '...';
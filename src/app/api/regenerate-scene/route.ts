@@ -91,7 +91,7 @@ export async function POST(req: Request) {
         });
         // Convert quality string to number: low=20, high=30, max=35
         const qualityValue = quality === 'high' ? 30 : quality === 'max' ? 35 : 20;
-        const imageResult = await generateSceneImage(scene.image_description, qualityValue);
+        const imageResult = await generateSceneImage(scene.image_description, qualityValue, user.id);
         
         if (!imageResult.success || !imageResult.imageUrl) {
           throw new Error('Failed to generate new image');
@@ -6,6 +6,13 @@ import { v4 as uuid } from 'uuid';
 const FLASK_SERVER = process.env.FLASK_SERVER || 'http://127.0.0.1:5000';
 const TIMEOUT_SECONDS = parseInt(process.env.FLASK_TIMEOUT || '300');
 
+// Identify the user so Flask can share generation slots fairly between users
+function flaskHeaders(clientId?: string): Record<string, string> {
+  return clientId
+    ? { 'Content-Type': 'application/json', 'X-Client-Id': clientId }
+    : { 'Content-Type': 'application/json' };
+}
+
 interface ImageGenResult {
   success: boolean;
   images: Buffer[];
@@ -13,19 +20,22 @@ interface ImageGenResult {
 }
 
 // Generate image using Flask server
-async function generateImageWithFlask(prompt: string, seed?: number, steps: number = 20): Promise<Buffer | null> {
+async function generateImageWithFlask(prompt: string, seed?: number, steps: number = 20, clientId?: string): Promise<Buffer | null> {
   try {
     const response = await fetch(`${FLASK_SERVER}/generate-image`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: flaskHeaders(clientId),
       body: JSON.stringify({
         prompt: prompt,
         negative_prompt: "blurry, low quality, distorted",
         steps: steps,
         cfg: 1.0,
-        seed: seed || Math.floor(Math.random() * 4294967296),
+        // Without a seed Flask picks a random one and skips its result cache
+        ...(seed ? { seed } : {}),
         width: 1024,
-        height: 1024
+        height: 1024,
+        // Receive the PNG bytes directly instead of base64 inside JSON
+        response_mode: 'binary'
       }),
     });
 
@@ -34,12 +44,9 @@ async function generateImageWithFlask(prompt: string, seed?: number, steps: numb
       return null;
     }
 
-    const data = await response.json();
-    
-    if (data.success && data.images && data.images.length > 0) {
-      // Convert base64 image to Buffer
-      const base64Image = data.images[0].image;
-      return Buffer.from(base64Image, 'base64');
+    const imageBuffer = Buffer.from(await response.arrayBuffer());
+    if (imageBuffer.length > 0) {
+      return imageBuffer;
     }
     
     return null;
@@ -52,11 +59,11 @@ async function generateImageWithFlask(prompt: string, seed?: number, steps: numb
 /**
  * Generate an image using Flask server
  */
-export async function generateImage(prompt: string, seed?: number, quality: number = 20): Promise<ImageGenResult> {
+export async function generateImage(prompt: string, seed?: number, quality: number = 20, clientId?: string): Promise<ImageGenResult> {
   try {
     console.log(`[Flask] Generating image for: "${prompt.slice(0, 50)}..."`);
 
-    const imageBuffer = await generateImageWithFlask(prompt, seed, quality);
+    const imageBuffer = await generateImageWithFlask(prompt, seed, quality, clientId);
     
     if (!imageBuffer) {
       return { success: false, images: [], error: 'Failed to generate image' };
@@ -79,11 +86,11 @@ export async function generateImage(prompt: string, seed?: number, quality: numb
 /**
  * Generate a single image for a scene
  */
-export async function generateSceneImage(imageDescription: string, quality: number = 20): Promise<{ success: boolean; imageUrl?: string; error?: string }> {
+export async function generateSceneImage(imageDescription: string, quality: number = 20, clientId?: string): Promise<{ success: boolean; imageUrl?: string; error?: string }> {
   try {
     console.log(`[Flask] Generating single scene image: "${imageDescription.slice(0, 60)}..."`); 
     
-    const result = await generateImage(imageDescription, undefined, quality);
+    const result = await generateImage(imageDescription, undefined, quality, clientId);
     
     if (result.success && result.images.length > 0) {
       // Save the image and return URL
@@ -110,27 +117,85 @@ export async function generateSceneImage(imageDescription: string, quality: numb
   }
 }
 
+interface FlaskBatchItem {
+  index: number;
+  success: boolean;
+  images?: Array<{ image: string; format: string }>;
+  error?: string;
+}
+
 /**
  * Generate multiple images for scenes
+ *
+ * All descriptions are sent to /generate-images in one request so ComfyUI can
+ * queue every prompt at once instead of idling between round trips. Results are
+ * streamed back as NDJSON lines as each prompt finishes, so a long storyboard
+ * never waits past the HTTP client's header timeout.
  */
-export async function generateSceneImages(imageDescriptions: string[], quality: number = 20): Promise<{ success: boolean; images: Buffer[]; errors: string[] }> {
+export async function generateSceneImages(imageDescriptions: string[], quality: number = 20, clientId?: string): Promise<{ success: boolean; images: Buffer[]; errors: string[] }> {
   const results: Buffer[] = [];
   const errors: string[] = [];
   
   console.log(`[Flask] Starting generation of ${imageDescriptions.length} scene images`);
   
-  for (let i = 0; i < imageDescriptions.length; i++) {
-    const description = imageDescriptions[i];
-    console.log(`[Flask] Generating scene ${i + 1}/${imageDescriptions.length}: "${description.slice(0, 60)}..."`);
+  try {
+    const response = await fetch(`${FLASK_SERVER}/generate-images`, {
+      method: 'POST',
+      headers: flaskHeaders(clientId),
+      body: JSON.stringify({
+        // Unseeded prompts get random seeds from Flask and are not written to its result cache
+        prompts: imageDescriptions,
+        negative_prompt: "blurry, low quality, distorted",
+        steps: quality,
+        cfg: 1.0,
+        width: 1024,
+        height: 1024,
+        stream: true
+      }),
+    });
+
+    if (!response.ok || !response.body) {
+      const text = await response.text();
+      console.error('Failed to generate scene images:', response.status, text);
+      return { success: false, images: [], errors: [`Batch request failed with status ${response.status}`] };
+    }
+
+    // Each line is one finished prompt, in completion order
+    const items: FlaskBatchItem[] = [];
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      buffered += decoder.decode(value, { stream: !done });
+      let newline: number;
+      while ((newline = buffered.indexOf('\n')) >= 0) {
+        const line = buffered.slice(0, newline).trim();
+        buffered = buffered.slice(newline + 1);
+        if (line) {
+          const item: FlaskBatchItem = JSON.parse(line);
+          items.push(item);
+          console.log(`[Flask] Scene ${item.index + 1} finished (${items.length}/${imageDescriptions.length})`);
+        }
+      }
+      if (done) break;
+    }
     
-    const result = await generateImage(description, undefined, quality);
+    if (items.length < imageDescriptions.length) {
+      errors.push(`Batch stream ended after ${items.length} of ${imageDescriptions.length} scenes`);
+    }
     
-    if (result.success && result.images.length > 0) {
-      results.push(result.images[0]); // Take first generated image
-    } else {
-      errors.push(`Scene ${i + 1}: ${result.error || 'Failed to generate image'}`);
-      console.error(`Failed to generate scene ${i + 1}:`, result.error);
+    for (const item of items.sort((a, b) => a.index - b.index)) {
+      if (item.success && item.images && item.images.length > 0) {
+        results.push(Buffer.from(item.images[0].image, 'base64')); // Take first generated image
+      } else {
+        errors.push(`Scene ${item.index + 1}: ${item.error || 'Failed to generate image'}`);
+        console.error(`Failed to generate scene ${item.index + 1}:`, item.error);
+      }
     }
+  } catch (error) {
+    console.error('Scene batch generation error:', error);
+    errors.push(error instanceof Error ? error.message : 'Unknown error occurred');
   }
   
   return {
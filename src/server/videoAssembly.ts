@@ -571,7 +571,7 @@ async function assembleVideo(imageUrls: string[], audioUrls: string[], audioDura
 /**
  * Main function to generate a complete video from story input
  */
-export async function generateVideo(inputText: string, visualStyle: string, ttsOptions?: TTSOptions, quality?: number): Promise<VideoGenerationResult> {
+export async function generateVideo(inputText: string, visualStyle: string, ttsOptions?: TTSOptions, quality?: number, clientId?: string): Promise<VideoGenerationResult> {
   const errors: string[] = [];
   const videoId = uuid(); // Generate unique video ID
   
@@ -591,7 +591,7 @@ export async function generateVideo(inputText: string, visualStyle: string, ttsO
     // Step 2: Generate images for all scenes
     console.log('[VideoAssembly] Step 2: Generating images for scenes...');
     const imageDescriptions = scenes.map(scene => scene.imageDescription);
-    const imageResult = await generateSceneImages(imageDescriptions, quality);
+    const imageResult = await generateSceneImages(imageDescriptions, quality, clientId);
     
     if (!imageResult.success || imageResult.images.length === 0) {
       return {